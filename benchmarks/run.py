@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Scale benchmarks of the payment hot paths against a seeded payment table and the SimulatedBackend.
+Run from the repository root with
+
+    python -m benchmarks.run --payments 100000 --repeat 5 --latency 0.001
+
+Each benchmark reports the items handled per second, p50 and p99 latency of a run and the queries of a run
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+SEED_BATCH_SIZE = 5000
+BULK_PAYMENTS = 1000
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def measure(name, func, repeat, setup=None):
+    """
+    Run func repeat times and collect its latency and query count. func returns the number of items it handled,
+    or (items, errors) when it counts the errors of its items. Runs raising an exception are counted as one error
+    :param name: Benchmark name
+    :param func: Function to measure
+    :param repeat: Number of runs
+    :param setup: Function run before each run, not measured
+    :return: dict of the results
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    samples = []
+    queries = []
+    items = 0
+    errors = 0
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            try:
+                result = func()
+                if isinstance(result, tuple):
+                    result, run_errors = result
+                    errors += run_errors
+                items += result
+            except Exception:
+                errors += 1
+            samples.append(time.perf_counter() - start)
+        queries.append(len(context))
+    return {
+        "name": name,
+        "runs": repeat,
+        "throughput": items / sum(samples) if sum(samples) else 0,
+        "p50": percentile(samples, 0.5),
+        "p99": percentile(samples, 0.99),
+        "queries": max(queries),
+        "errors": errors,
+    }
+
+
+def seed_payments(crypto, count):
+    """
+    Insert count open payments for crypto with made up addresses
+    """
+    from cryptocurrency_payment.models import CryptoCurrencyPayment
+
+    for start in range(0, count, SEED_BATCH_SIZE):
+        CryptoCurrencyPayment.objects.bulk_create(
+            [
+                CryptoCurrencyPayment(
+                    crypto=crypto,
+                    address="bench-{}".format(index),
+                    crypto_amount=Decimal("0.0005"),
+                    fiat_amount=Decimal(10),
+                    fiat_currency="USD",
+                )
+                for index in range(start, min(count, start + SEED_BATCH_SIZE))
+            ]
+        )
+
+
+def reset_payments(crypto, **fields):
+    from cryptocurrency_payment.models import CryptoCurrencyPayment
+
+    fields.setdefault("status", CryptoCurrencyPayment.PAYMENT_NEW)
+    CryptoCurrencyPayment.objects.filter(crypto=crypto).update(
+        tx_hash=None, next_check_at=None, lease_owner=None, lease_expires_at=None, **fields
+    )
+
+
+def run_benchmarks(payments, repeat, crypto="BITCOIN"):
+    """
+    Seed open payments and measure each hot path. Expects the crypto to use the SimulatedBackend
+    :param payments: Size of the payment table
+    :param repeat: Number of runs of each benchmark
+    :param crypto: The crypto in config
+    :return: list of results, see measure
+    """
+    from django.utils import timezone
+
+    from cryptocurrency_payment import tasks
+    from cryptocurrency_payment.app_settings import get_backend_config, get_backend_obj
+    from cryptocurrency_payment.models import (
+        create_new_payment, create_new_payments_bulk, get_new_address, CryptoCurrencyPayment, PaymentTaskRun
+    )
+
+    seed_payments(crypto, payments)
+    backend = get_backend_obj(crypto)
+    address_type = get_backend_config(crypto, "ADDRESS_TYPE")
+    derivation_path = get_backend_config(crypto, "DERIVATION_PATH")
+    indexes = iter(range(10 ** 9))
+
+    def create_payment():
+        create_new_payment(crypto, 10, "USD")
+        return 1
+
+    def create_payments_bulk():
+        items = [{"fiat_amount": 10, "fiat_currency": "USD"}] * min(payments, BULK_PAYMENTS)
+        return len(create_new_payments_bulk(crypto, items))
+
+    def derive_address():
+        get_new_address(backend, next(indexes), address_type, derivation_path)
+        return 1
+
+    def update_status():
+        tasks.update_payment_status()
+        run = PaymentTaskRun.objects.filter(task="update_payment_status", crypto=crypto).latest("started_at")
+        return CryptoCurrencyPayment.objects.filter(crypto=crypto).count(), run.errors
+
+    def cancel_unpaid():
+        return sum(tasks.cancel_unpaid_payment().values())
+
+    def refresh_prices():
+        return sum(tasks.refresh_payment_prices().values())
+
+    def make_payments_old(field):
+        def setup():
+            old = timezone.now() - timedelta(days=2)
+            reset_payments(crypto)
+            CryptoCurrencyPayment.objects.filter(crypto=crypto).update(**{field: old})
+        return setup
+
+    return [
+        measure("get_new_address", derive_address, repeat),
+        measure("create_new_payment", create_payment, repeat),
+        measure("create_new_payments_bulk", create_payments_bulk, repeat),
+        measure("update_payment_status", update_status, repeat, setup=lambda: reset_payments(crypto)),
+        measure("cancel_unpaid_payment", cancel_unpaid, repeat, setup=make_payments_old("created_at")),
+        measure("refresh_payment_prices", refresh_prices, repeat, setup=make_payments_old("updated_at")),
+    ]
+
+
+def print_results(results, out=sys.stdout):
+    out.write(
+        "{:<24} {:>6} {:>14} {:>10} {:>10} {:>8} {:>7}\n".format(
+            "benchmark", "runs", "items/s", "p50 ms", "p99 ms", "queries", "errors"
+        )
+    )
+    for result in results:
+        out.write(
+            (
+                "{name:<24} {runs:>6} {throughput:>14.1f} {p50_ms:>10.2f} {p99_ms:>10.2f} {queries:>8} {errors:>7}\n"
+            ).format(
+                p50_ms=result["p50"] * 1000, p99_ms=result["p99"] * 1000, **result
+            )
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--payments", type=int, default=10000, help="Size of the seeded payment table")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each benchmark")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds the simulated backend takes per call")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of simulated backend calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated backend outcomes")
+    options = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import override_settings
+
+    from cryptocurrency_payment.test_utils.backends import SimulatedBackend
+
+    crypto_settings = copy.deepcopy(settings.CRYPTOCURRENCY_PAYMENT)
+    crypto_settings["BITCOIN"]["BACKEND"] = "cryptocurrency_payment.test_utils.backends.SimulatedBackend"
+    SimulatedBackend.configure(latency=options.latency, error_rate=options.error_rate, seed=options.seed)
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings):
+            results = run_benchmarks(options.payments, options.repeat)
+    finally:
+        runner.teardown_databases(old_config)
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
+import django
+
 __version__ = '0.1.4'
+
+if django.VERSION < (3, 2):
+    default_app_config = 'cryptocurrency_payment.apps.CryptocurrencyPaymentConfig'
@@ -1,15 +1,191 @@
 # -*- coding: utf-8 -*-
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.utils.functional import cached_property
 
+from .app_settings import get_active_backends
 from .models import (
-   CryptoCurrencyPayment
+   CryptoCurrencyPayment,
+   PaymentTaskRun,
 )
+from .tasks import CryptoCurrencyPaymentTask
+
+
+def get_estimated_count(queryset):
+    """
+    Row count of the table of an unfiltered queryset from the statistics of the database, read from pg_class on
+    PostgreSQL and information_schema on MySQL
+    :param queryset: Queryset to count
+    :return: Estimated count or None when the queryset is filtered or the database keeps no estimate
+    """
+    if queryset.query.where:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == "mysql":
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting an unfiltered changelist from the table statistics instead of COUNT(*) once the table holds
+    more than ESTIMATE_THRESHOLD rows. Filtered changelists and small tables are counted exactly
+    """
+
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        estimate = get_estimated_count(self.object_list)
+        if estimate is not None and estimate > self.ESTIMATE_THRESHOLD:
+            return estimate
+        return super(EstimatedCountPaginator, self).count
+
+
+class CryptoListFilter(admin.SimpleListFilter):
+    """
+    Filter on the active cryptos of the settings, so the changelist does not read the distinct cryptos of the table
+    """
+
+    title = "crypto"
+    parameter_name = "crypto"
+
+    def lookups(self, request, model_admin):
+        return [(crypto, crypto) for crypto in get_active_backends()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(crypto=self.value())
+        return queryset
 
 
 @admin.register(CryptoCurrencyPayment)
 class CrptoCurrancyPaymentAdmin(admin.ModelAdmin):
-    pass
+    """
+    Payment admin for large payment tables. The changelist is ordered, filtered and searched on indexed columns
+    only, search matches whole addresses and transaction hashes. Actions update the selected payments with the
+    set based task code, one crypto at a time
+    """
+
+    list_display = (
+        "id",
+        "crypto",
+        "address",
+        "status",
+        "crypto_amount",
+        "fiat_amount",
+        "fiat_currency",
+        "user",
+        "content_type",
+        "created_at",
+    )
+    list_select_related = ("user", "content_type")
+    list_filter = ("status", CryptoListFilter, "created_at")
+    search_fields = ("address", "tx_hash")
+    ordering = ("-created_at",)
+    raw_id_fields = ("user", "parent_payment", "child_payment")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ["recheck_payments", "cancel_payments", "refresh_payment_prices"]
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(Q(address=search_term) | Q(tx_hash=search_term)), False
+
+    def run_crypto_tasks(self, request, queryset, method, message):
+        """
+        Call a task method with the selected payments of each crypto
+        :param queryset: Selected payments
+        :param method: Name of the CryptoCurrencyPaymentTask method taking a queryset of payments
+        :param message: Message format of the number of updated payments
+        :return:
+        """
+        active_backends = get_active_backends()
+        updated = 0
+        for crypto in queryset.order_by().values_list("crypto", flat=True).distinct():
+            if crypto not in active_backends:
+                self.message_user(
+                    request, "{} payments skipped, the backend is not active".format(crypto), messages.WARNING
+                )
+                continue
+            crypto_task = CryptoCurrencyPaymentTask(crypto)
+            updated += getattr(crypto_task, method)(queryset.filter(crypto=crypto))
+        self.message_user(request, message.format(updated))
+
+    def recheck_payments(self, request, queryset):
+        self.run_crypto_tasks(
+            request,
+            queryset.filter(status__in=CryptoCurrencyPayment.OPEN_STATUSES),
+            "update_payments_status",
+            "{} payments checked",
+        )
+
+    recheck_payments.short_description = "Re-check selected payments now"
+
+    def cancel_payments(self, request, queryset):
+        self.run_crypto_tasks(request, queryset, "cancel_payments", "{} payments cancelled")
+
+    cancel_payments.short_description = "Cancel selected new and waiting payments"
+
+    def refresh_payment_prices(self, request, queryset):
+        self.run_crypto_tasks(request, queryset, "refresh_payments_amount", "{} payment prices refreshed")
+
+    refresh_payment_prices.short_description = "Refresh price of selected new and waiting payments"
+
+
+@admin.register(PaymentTaskRun)
+class PaymentTaskRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "task",
+        "crypto",
+        "status",
+        "started_at",
+        "duration",
+        "rows_scanned",
+        "rows_changed",
+        "backend_calls",
+        "errors",
+    )
+    list_filter = ("task", CryptoListFilter, "status")
+    date_hierarchy = "started_at"
+    change_list_template = "admin/cryptocurrency_payment/paymenttaskrun/change_list.html"
 
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
 
+    def changelist_view(self, request, extra_context=None):
+        response = super(PaymentTaskRunAdmin, self).changelist_view(request, extra_context=extra_context)
+        if hasattr(response, "context_data") and "cl" in response.context_data:
+            response.context_data["run_summary"] = (
+                response.context_data["cl"]
+                .queryset.values("task", "crypto")
+                .annotate(
+                    runs=Count("pk"),
+                    failed=Count("pk", filter=Q(status=PaymentTaskRun.RUN_FAILED)),
+                    avg_duration=Avg("duration"),
+                    max_duration=Max("duration"),
+                    rows_scanned=Sum("rows_scanned"),
+                    rows_changed=Sum("rows_changed"),
+                    backend_calls=Sum("backend_calls"),
+                    errors=Sum("errors"),
+                )
+                .order_by("task", "crypto")
+            )
+        return response
@@ -1,7 +1,41 @@
+import copy
 import importlib
+import threading
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from hdwallet import HDWallet
 
+from cryptocurrency_payment.metrics import timed
+
+
+BACKEND_CONFIG_DEFAULTS = {
+    "ADDRESS_POOL_SIZE": 0,
+    "ADDRESS_POOL_LOW_WATER": None,
+    "POLL_CONCURRENCY": 1,
+    "POLL_BATCH_SIZE": 100,
+    "POLL_LEASE_SECONDS": 300,
+    "BLOCK_INTERVAL_SECONDS": 0,
+    "POLL_MIN_INTERVAL_SECONDS": 0,
+    "POLL_MAX_INTERVAL_SECONDS": 0,
+    "POLL_BACKOFF_AFTER_SECONDS": 0,
+    "NOTIFY_SECRET": None,
+    "NOTIFY_POLL_DELAY_SECONDS": 3600,
+    "INGEST_SOURCE": None,
+    "INGEST_SOURCE_OPTIONS": None,
+    "TASK_RUN_CONCURRENCY": 1,
+    "TASK_RUN_TIMEOUT_SECONDS": 3600,
+    "ASYNC_POLL_CONCURRENCY": 100,
+    "URI_SCHEME": "bitcoin",
+    "EXCHANGE_RATE_TTL": 0,
+    "EXCHANGE_RATE_CACHE": "default",
+    "CRYPTO_DECIMAL_PLACES": 8,
+}
+
+_backend_registry = {}
+_backend_registry_lock = threading.Lock()
+
 
 def get_settings():
 
@@ -14,6 +48,8 @@ def get_backend_config(crypto, key=None):
     if not crypto_backend or crypto_backend["ACTIVE"] is not True:
         raise Exception("{} backend not found".format(crypto))
     if key:
+        if key not in crypto_backend and key in BACKEND_CONFIG_DEFAULTS:
+            return BACKEND_CONFIG_DEFAULTS[key]
         return crypto_backend[key]
     return crypto_backend
 
@@ -22,7 +58,13 @@ def get_active_backends():
     return [key for key, value in get_settings().items() if value["ACTIVE"] is True]
 
 
-def get_backend_obj(crypto):
+def build_backend_obj(crypto):
+    """
+    Import the configured backend class and build it with a wallet parsed from the master public key.
+    This is the expensive path, use get_backend_obj to get a cached copy
+    :param crypto: The crypto in config to build a backend for
+    :return: backend obj
+    """
     crypto_backend = get_backend_config(crypto=crypto, key="BACKEND")
     module = ".".join(crypto_backend.split(".")[:-1])
     Class = crypto_backend.split(".")[-1]
@@ -34,3 +76,45 @@ def get_backend_obj(crypto):
     b = Backend(get_backend_config(crypto, key="MASTER_PUBLIC_KEY"), symbol)
     b.wallet = wallet
     return b
+
+
+def get_backend_obj(crypto):
+    """
+    Get a backend for a crypto. Each configured crypto is built once per process and every caller
+    gets its own shallow copy with its own wallet, so derivation done by one caller does not leak into another.
+    Entries are rebuilt when the crypto config changes
+    :param crypto: The crypto in config
+    :return: backend obj
+    """
+    with timed("get_backend_obj", crypto):
+        crypto_config = get_backend_config(crypto)
+        key = crypto.upper()
+        entry = _backend_registry.get(key)
+        if entry is None or entry[0] != crypto_config:
+            with _backend_registry_lock:
+                entry = _backend_registry.get(key)
+                if entry is None or entry[0] != crypto_config:
+                    entry = (copy.deepcopy(crypto_config), build_backend_obj(crypto))
+                    _backend_registry[key] = entry
+        b = copy.copy(entry[1])
+        b.wallet = copy.copy(entry[1].wallet)
+        return b
+
+
+def clear_backend_cache(crypto=None):
+    """
+    Drop cached backends so they are rebuilt on next use
+    :param crypto: Only drop this crypto, all cryptos when None
+    :return:
+    """
+    with _backend_registry_lock:
+        if crypto is None:
+            _backend_registry.clear()
+        else:
+            _backend_registry.pop(crypto.upper(), None)
+
+
+@receiver(setting_changed)
+def _clear_backend_cache_on_setting_changed(setting, **kwargs):
+    if setting == "CRYPTOCURRENCY_PAYMENT":
+        clear_backend_cache()
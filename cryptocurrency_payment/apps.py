@@ -4,3 +4,9 @@ from django.apps import AppConfig
 
 class CryptocurrencyPaymentConfig(AppConfig):
     name = 'cryptocurrency_payment'
+
+    def ready(self):
+        from cryptocurrency_payment import events  # noqa: F401 connects the payment change publisher
+        from cryptocurrency_payment.metrics import get_metrics_sink
+
+        get_metrics_sink()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.shortcuts import reverse
+
+from cryptocurrency_payment import qr
+from cryptocurrency_payment.app_settings import get_backend_config
+from cryptocurrency_payment.models import CryptoCurrencyPayment
+
+PAYMENT_VERSION_KEY = "cryptocurrency_payment:payment_version:{}"
+PAYMENT_VERSION_TTL = 24 * 60 * 60
+STATUS_FIELDS = (
+    "id", "crypto", "user_id", "status", "address", "crypto_amount", "paid_crypto_amount", "tx_hash",
+    "child_payment_id", "payment_title", "payment_description", "updated_at",
+)
+CLOSED_STATUSES = (CryptoCurrencyPayment.PAYMENT_PAID, CryptoCurrencyPayment.PAYMENT_CANCELLED)
+
+
+def get_events_cache():
+    return caches[getattr(settings, "CRYPTOCURRENCY_PAYMENT_EVENTS_CACHE", "default")]
+
+
+def publish_payment_change(payment):
+    """
+    Tell payment event streams that a payment changed by storing its updated_at in the events cache
+    :param payment: Saved payment
+    :return:
+    """
+    get_events_cache().set(
+        PAYMENT_VERSION_KEY.format(payment.pk), payment.updated_at.timestamp(), PAYMENT_VERSION_TTL
+    )
+
+
+def get_payment_version(pk):
+    return get_events_cache().get(PAYMENT_VERSION_KEY.format(pk))
+
+
+@receiver(post_save, sender=CryptoCurrencyPayment)
+def _publish_payment_saved(sender, instance, created, **kwargs):
+    if not created:
+        publish_payment_change(instance)
+
+
+def get_payment_status(pk):
+    """
+    Read the columns of a payment needed to show its status
+    :param pk: Payment id
+    :return: dict of STATUS_FIELDS or None when there is no such payment
+    """
+    return CryptoCurrencyPayment.objects.filter(pk=pk).values(*STATUS_FIELDS).first()
+
+
+def get_payment_status_data(payment):
+    """
+    Status of a payment as sent to checkout pages, with the payment URI and QR code URL that change with the
+    amount after a price refresh
+    :param payment: dict from get_payment_status
+    :return: dict
+    """
+    paid_crypto_amount = payment["paid_crypto_amount"] or 0
+    remaining_crypto_amount = None
+    if payment["crypto_amount"] > paid_crypto_amount:
+        remaining_crypto_amount = payment["crypto_amount"] - paid_crypto_amount
+    child_payment_url = None
+    if payment["child_payment_id"]:
+        child_payment_url = reverse(
+            "cryptocurrency_payment:crypto_payment_detail", args=(payment["child_payment_id"],)
+        )
+    uri = qr.get_payment_uri(
+        get_backend_config(payment["crypto"], key="URI_SCHEME"),
+        payment["address"],
+        payment["crypto_amount"],
+        payment["payment_title"],
+        payment["payment_description"],
+    )
+    return {
+        "status": payment["status"],
+        "crypto_amount": payment["crypto_amount"],
+        "paid_crypto_amount": payment["paid_crypto_amount"],
+        "remaining_crypto_amount": remaining_crypto_amount,
+        "tx_hash": payment["tx_hash"],
+        "child_payment_url": child_payment_url,
+        "payment_uri": uri,
+        "qr_url": qr.get_qr_url(payment["id"], uri),
+        "updated_at": payment["updated_at"],
+    }
+
+
+class PaymentEventStream:
+    """
+    Server-Sent Events of a payment. The events cache is checked every poll_interval seconds and the payment
+    is only read when its version changed there, or every refresh_interval seconds to catch bulk updates that
+    do not publish. A status event is sent for every change, the stream ends once the payment is closed or after
+    max_duration seconds, browsers reconnect after retry milliseconds.
+    Iterate it synchronously under WSGI or asynchronously under ASGI so no worker thread is held while waiting
+    """
+
+    def __init__(self, pk, poll_interval=1, refresh_interval=30, heartbeat_interval=15, max_duration=300, retry=3000):
+        self.pk = pk
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_duration = max_duration
+        self.retry = retry
+        self.version = None
+        self.last_data = None
+        self.refreshed_at = None
+        self.written_at = None
+        self.started_at = None
+
+    def poll(self):
+        """
+        Check the payment once
+        :return: messages to send, True when the stream is over
+        """
+        now = time.monotonic()
+        if self.started_at is None:
+            self.started_at = self.written_at = now
+            messages = ["retry: {}\n\n".format(self.retry)]
+        else:
+            messages = []
+        version = get_payment_version(self.pk)
+        if self.refreshed_at is None or version != self.version or now - self.refreshed_at >= self.refresh_interval:
+            self.version = version
+            self.refreshed_at = now
+            payment = get_payment_status(self.pk)
+            if payment is None:
+                return messages, True
+            data = get_payment_status_data(payment)
+            if data != self.last_data:
+                self.last_data = data
+                messages.append(
+                    "event: status\ndata: {}\n\n".format(json.dumps(data, cls=DjangoJSONEncoder))
+                )
+            if payment["status"] in CLOSED_STATUSES:
+                return messages, True
+        if not messages and now - self.written_at >= self.heartbeat_interval:
+            messages.append(": keepalive\n\n")
+        if messages:
+            self.written_at = now
+        return messages, now - self.started_at >= self.max_duration
+
+    def chunk(self):
+        """
+        Messages of a single poll, for ASGI servers of Django older than 4.2 that iterate streaming responses inside
+        their event loop where waiting would block it. The response ends right away and browsers reconnect after
+        retry milliseconds for the next poll
+        :return: messages to send
+        """
+        return self.poll()[0]
+
+    def __iter__(self):
+        while True:
+            messages, done = self.poll()
+            for message in messages:
+                yield message
+            if done:
+                return
+            time.sleep(self.poll_interval)
+
+    async def __aiter__(self):
+        poll = sync_to_async(self.poll)
+        while True:
+            messages, done = await poll()
+            for message in messages:
+                yield message
+            if done:
+                return
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import importlib
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+
+from cryptocurrency_payment.app_settings import get_backend_config
+from cryptocurrency_payment.models import CryptoCurrencyPayment
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+
+def get_ingest_source(crypto):
+    """
+    Import the INGEST_SOURCE class of a crypto and build it with INGEST_SOURCE_OPTIONS as keyword arguments
+    :param crypto: The crypto in config
+    :return: source obj
+    """
+    ingest_source = get_backend_config(crypto, "INGEST_SOURCE")
+    if not ingest_source:
+        raise Exception("{} has no INGEST_SOURCE".format(crypto))
+    module = importlib.import_module(".".join(ingest_source.split(".")[:-1]))
+    Source = getattr(module, ingest_source.split(".")[-1])
+    return Source(**(get_backend_config(crypto, "INGEST_SOURCE_OPTIONS") or {}))
+
+
+class FileTransactionSource:
+    """
+    Read chain events from a file with one JSON event per line, stands in for a node in tests and can replay
+    events exported from one. Events are either a mempool transaction
+    {"type": "mempool", "txid": "...", "outputs": [{"address": "...", "value": "0.001"}]}
+    or a block {"type": "block", "height": 100, "transactions": [{"txid": "...", "outputs": [...]}]}.
+    With follow the file is tailed for new events like tail -f
+    """
+
+    def __init__(self, path, follow=False, poll_interval=1):
+        self.path = path
+        self.follow = follow
+        self.poll_interval = poll_interval
+
+    def iter_events(self):
+        with open(self.path) as events:
+            while True:
+                line = events.readline()
+                if not line:
+                    if not self.follow:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                if line.strip():
+                    yield json.loads(line)
+
+
+class WatchedAddresses:
+    """
+    Addresses of the open payments of a crypto held in memory. The first refresh loads every open payment,
+    later refreshes only read payments updated since the previous one to add new payments and drop closed ones
+    """
+
+    REFRESH_OVERLAP = timedelta(seconds=60)
+
+    def __init__(self, crypto):
+        self.crypto = crypto
+        self.payments = {}
+        self.refreshed_at = None
+
+    def __contains__(self, address):
+        return address in self.payments
+
+    def __len__(self):
+        return len(self.payments)
+
+    def refresh(self, max_age=None):
+        """
+        Update the set from payments changed since the last refresh. Payments updated a little before the last refresh
+        are read again in case their transaction was not committed yet when it ran
+        :param max_age: Skip the refresh when the set was refreshed less than this timedelta ago
+        :return:
+        """
+        now = timezone.now()
+        if max_age is not None and self.refreshed_at is not None and now - self.refreshed_at < max_age:
+            return
+        payments = CryptoCurrencyPayment.objects.filter(crypto=self.crypto)
+        if self.refreshed_at is None:
+            payments = payments.filter(status__in=CryptoCurrencyPayment.OPEN_STATUSES)
+        else:
+            payments = payments.filter(updated_at__gte=self.refreshed_at - self.REFRESH_OVERLAP)
+        for pk, address, status in payments.values_list("pk", "address", "status").iterator():
+            if status in CryptoCurrencyPayment.OPEN_STATUSES:
+                self.payments.setdefault(address, set()).add(pk)
+            elif address in self.payments:
+                self.payments[address].discard(pk)
+                if not self.payments[address]:
+                    del self.payments[address]
+        self.refreshed_at = now
+
+
+class BlockScanner:
+    """
+    Update payments from the blocks and mempool transactions of an ingest source instead of asking the backend
+    about each payment address. Outputs are matched against the WatchedAddresses of the crypto so the cost of
+    a scan follows the chain throughput and not the number of open payments.
+    Transactions seen in a block are kept in memory until they reach BALANCE_CONFIRMATION_NUM, after a restart
+    their processing payments are confirmed by update_payment_status.
+    The watched addresses are refreshed on every block and at most every MEMPOOL_REFRESH_INTERVAL for mempool
+    transactions
+    """
+
+    MEMPOOL_REFRESH_INTERVAL = timedelta(seconds=10)
+
+    def __init__(self, crypto, source=None):
+        self.crypto = crypto
+        self.task = CryptoCurrencyPaymentTask(crypto)
+        self.source = source or get_ingest_source(crypto)
+        self.watched = WatchedAddresses(crypto)
+        self.pending = {}
+        self.height = None
+
+    def run(self):
+        """
+        Process events of the source until it stops
+        :return: Number of payments updated
+        """
+        updated = 0
+        for event in self.source.iter_events():
+            updated += self.process_event(event)
+        return updated
+
+    def process_event(self, event):
+        """
+        Update payments paid by the transactions of a block or mempool event
+        :param event: Block or mempool event, see FileTransactionSource
+        :return: Number of payments updated
+        """
+        if event["type"] != "block":
+            self.watched.refresh(max_age=self.MEMPOOL_REFRESH_INTERVAL)
+            return self.process_transaction(event)
+        self.watched.refresh()
+        self.height = event["height"]
+        updated = self.confirm_pending()
+        for transaction in event["transactions"]:
+            updated += self.process_transaction(transaction, event["height"])
+        return updated
+
+    def process_transaction(self, transaction, height=None):
+        """
+        Sum the outputs of a transaction paying watched addresses and update their payments
+        :param transaction: Transaction with its txid and outputs
+        :param height: Height of the block of the transaction, None for a mempool transaction
+        :return: Number of payments updated
+        """
+        outputs = {}
+        for output in transaction["outputs"]:
+            address = output.get("address")
+            if address in self.watched:
+                outputs[address] = outputs.get(address, Decimal(0)) + Decimal(str(output["value"]))
+        if not outputs:
+            return 0
+        confirmations = 0 if height is None else self.height - height + 1
+        if height is not None and confirmations < self.task.confirmation_number:
+            self.pending[transaction["txid"]] = (height, outputs)
+        return self.update_payments(transaction["txid"], outputs, confirmations)
+
+    def confirm_pending(self):
+        """
+        Update payments of transactions that reached BALANCE_CONFIRMATION_NUM with the current height
+        :return: Number of payments updated
+        """
+        updated = 0
+        for txid, (height, outputs) in list(self.pending.items()):
+            confirmations = self.height - height + 1
+            if confirmations >= self.task.confirmation_number:
+                del self.pending[txid]
+                updated += self.update_payments(txid, outputs, confirmations)
+        return updated
+
+    def update_payments(self, txid, outputs, confirmations):
+        """
+        Update open payments of the paid addresses. Payments already following another transaction are left alone.
+        The payments are picked before any is updated, so the child payment of a payment underpaid by the
+        transaction is not paid by the same transaction
+        :param txid: Transaction hash
+        :param outputs: Value paid to each address by the transaction
+        :param confirmations: Confirmations of the transaction
+        :return: Number of payments updated
+        """
+        payment_pks = list(
+            CryptoCurrencyPayment.objects.filter(
+                crypto=self.crypto,
+                status__in=CryptoCurrencyPayment.OPEN_STATUSES,
+                address__in=list(outputs),
+            )
+            .filter(Q(tx_hash__isnull=True) | Q(tx_hash=txid))
+            .values_list("pk", flat=True)
+        )
+        if not payment_pks:
+            return 0
+        payments = CryptoCurrencyPayment.objects.filter(pk__in=payment_pks)
+
+        def confirm_payments(chunk):
+            return [
+                (payment, self.get_payment_status(payment, txid, outputs[payment.address], confirmations))
+                for payment in chunk
+            ]
+
+        return self.task.update_payments_status(payments, notified=True, confirm_payments=confirm_payments)
+
+    def get_payment_status(self, payment, txid, value, confirmations):
+        """
+        Status and value of a payment paid by a transaction, the same as the backend confirm_address_payment returns
+        :return: (status, value)
+        """
+        backend = self.task.backend_obj
+        payment.tx_hash = txid
+        if confirmations < self.task.confirmation_number:
+            return backend.UNCONFIRMED_ADDRESS_BALANCE, txid
+        if value < payment.crypto_amount:
+            return backend.UNDERPAID_ADDRESS_BALANCE, payment.crypto_amount - value
+        return backend.CONFIRMED_ADDRESS_BALANCE, value
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from cryptocurrency_payment.app_settings import get_active_backends
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+
+class Command(BaseCommand):
+    help = "Derive addresses into the address pool of active backends up to ADDRESS_POOL_SIZE"
+
+    def add_arguments(self, parser):
+        parser.add_argument("crypto", nargs="*", help="Cryptos to refill, all active backends if not given")
+
+    def handle(self, *args, **options):
+        cryptos = options["crypto"] or get_active_backends()
+        for crypto in cryptos:
+            added = CryptoCurrencyPaymentTask(crypto).refill_address_pool()
+            self.stdout.write("{}: {} addresses added".format(crypto, added))
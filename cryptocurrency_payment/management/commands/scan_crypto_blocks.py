@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from cryptocurrency_payment.ingest import BlockScanner
+
+
+class Command(BaseCommand):
+    help = "Update payments of a crypto from the blocks and mempool transactions of its INGEST_SOURCE"
+
+    def add_arguments(self, parser):
+        parser.add_argument("crypto", help="Crypto to scan")
+
+    def handle(self, *args, **options):
+        updated = BlockScanner(options["crypto"]).run()
+        self.stdout.write("{}: {} payments updated".format(options["crypto"], updated))
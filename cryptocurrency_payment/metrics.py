@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import functools
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from cryptocurrency_payment.signals import operation_timed, payment_status_changed
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics_sink = None
+_metrics_sink_lock = threading.Lock()
+
+
+@contextmanager
+def timed(operation, crypto):
+    """
+    Time the wrapped block and send operation_timed, the block raising is sent as an error
+    :param operation: Name of the operation
+    :param crypto: The crypto in config the operation runs for
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        operation_timed.send(
+            sender=operation, crypto=crypto, operation=operation, duration=time.perf_counter() - start, error=error
+        )
+
+
+def timed_method(operation):
+    """
+    Time a CryptoCurrencyPaymentTask method or coroutine method, see timed
+    :param operation: Name of the operation
+    """
+
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with timed(operation, self.crypto):
+                    return await method(self, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with timed(operation, self.crypto):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsSink:
+    """
+    Collects instrumentation signals. Subclasses implement record_operation and record_status_change
+    to forward them to a metrics system
+    """
+
+    def connect(self):
+        operation_timed.connect(self.on_operation_timed, dispatch_uid=id(self), weak=False)
+        payment_status_changed.connect(self.on_payment_status_changed, dispatch_uid=id(self), weak=False)
+
+    def disconnect(self):
+        operation_timed.disconnect(dispatch_uid=id(self))
+        payment_status_changed.disconnect(dispatch_uid=id(self))
+
+    def on_operation_timed(self, sender, crypto, operation, duration, error, **kwargs):
+        self.record_operation(crypto.upper(), operation, duration, error)
+
+    def on_payment_status_changed(self, sender, crypto, old_status, new_status, count=1, **kwargs):
+        self.record_status_change(crypto.upper(), old_status, new_status, count)
+
+    def record_operation(self, crypto, operation, duration, error):
+        raise NotImplementedError
+
+    def record_status_change(self, crypto, old_status, new_status, count):
+        raise NotImplementedError
+
+
+class PrometheusMetricsSink(MetricsSink):
+    """
+    Keeps latency histograms, error counts and status transition counts in memory and renders them
+    in the Prometheus text format. Every process keeps its own counts
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.errors = {}
+        self.transitions = {}
+
+    def record_operation(self, crypto, operation, duration, error):
+        key = (crypto, operation)
+        with self.lock:
+            if key not in self.operations:
+                self.operations[key] = [[0] * len(self.buckets), 0, 0.0]
+            histogram = self.operations[key]
+            for position, bucket in enumerate(self.buckets):
+                if duration <= bucket:
+                    histogram[0][position] += 1
+            histogram[1] += 1
+            histogram[2] += duration
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def record_status_change(self, crypto, old_status, new_status, count):
+        key = (crypto, old_status, new_status)
+        with self.lock:
+            self.transitions[key] = self.transitions.get(key, 0) + count
+
+    def render(self):
+        lines = [
+            "# HELP cryptocurrency_payment_operation_seconds Duration of instrumented operations",
+            "# TYPE cryptocurrency_payment_operation_seconds histogram",
+        ]
+        with self.lock:
+            for (crypto, operation), (counts, count, total) in sorted(self.operations.items()):
+                labels = 'crypto="{}",operation="{}"'.format(crypto, operation)
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    lines.append(
+                        'cryptocurrency_payment_operation_seconds_bucket{{{},le="{}"}} {}'.format(
+                            labels, bucket, bucket_count
+                        )
+                    )
+                lines.append(
+                    'cryptocurrency_payment_operation_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, count)
+                )
+                lines.append("cryptocurrency_payment_operation_seconds_sum{{{}}} {}".format(labels, total))
+                lines.append("cryptocurrency_payment_operation_seconds_count{{{}}} {}".format(labels, count))
+            lines.append("# HELP cryptocurrency_payment_operation_errors_total Instrumented operations that raised")
+            lines.append("# TYPE cryptocurrency_payment_operation_errors_total counter")
+            for (crypto, operation), errors in sorted(self.errors.items()):
+                lines.append(
+                    'cryptocurrency_payment_operation_errors_total{{crypto="{}",operation="{}"}} {}'.format(
+                        crypto, operation, errors
+                    )
+                )
+            lines.append("# HELP cryptocurrency_payment_status_transitions_total Payment status changes")
+            lines.append("# TYPE cryptocurrency_payment_status_transitions_total counter")
+            for (crypto, old_status, new_status), count in sorted(self.transitions.items()):
+                lines.append(
+                    'cryptocurrency_payment_status_transitions_total{{crypto="{}",from="{}",to="{}"}} {}'.format(
+                        crypto, old_status, new_status, count
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics_sink():
+    """
+    Get the sink of the CRYPTOCURRENCY_PAYMENT_METRICS_SINK setting, built and connected once per process.
+    The sink is rebuilt when the setting changes
+    :return: sink obj or None when no sink is set
+    """
+    global _metrics_sink
+    sink_path = getattr(settings, "CRYPTOCURRENCY_PAYMENT_METRICS_SINK", None)
+    with _metrics_sink_lock:
+        if _metrics_sink is not None and _metrics_sink[0] != sink_path:
+            _metrics_sink[1].disconnect()
+            _metrics_sink = None
+        if _metrics_sink is None and sink_path:
+            module = importlib.import_module(".".join(sink_path.split(".")[:-1]))
+            sink = getattr(module, sink_path.split(".")[-1])()
+            sink.connect()
+            _metrics_sink = (sink_path, sink)
+        return _metrics_sink[1] if _metrics_sink else None
+
+
+@receiver(setting_changed)
+def _reconnect_metrics_sink_on_setting_changed(setting, **kwargs):
+    if setting == "CRYPTOCURRENCY_PAYMENT_METRICS_SINK":
+        get_metrics_sink()
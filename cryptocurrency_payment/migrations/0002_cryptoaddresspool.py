@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CryptoAddressPool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('crypto', models.CharField(max_length=50)),
+                ('address_type', models.CharField(max_length=20)),
+                ('derivation_path', models.CharField(max_length=100)),
+                ('address_index', models.PositiveIntegerField()),
+                ('address', models.CharField(max_length=200)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('crypto', 'address_type', 'derivation_path', 'address_index')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='cryptoaddresspool',
+            index=models.Index(fields=['crypto', 'address_type', 'derivation_path', 'claimed_at', 'address_index'], name='crypto_pool_free_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+from django.db.models import Count, Max
+from django.db.models.functions import Upper
+
+
+def seed_address_sequences(apps, schema_editor):
+    CryptoCurrencyPayment = apps.get_model('cryptocurrency_payment', 'CryptoCurrencyPayment')
+    CryptoAddressPool = apps.get_model('cryptocurrency_payment', 'CryptoAddressPool')
+    CryptoAddressSequence = apps.get_model('cryptocurrency_payment', 'CryptoAddressSequence')
+    next_indexes = {}
+    used_counts = CryptoCurrencyPayment.objects.annotate(crypto_upper=Upper('crypto')).values(
+        'crypto_upper'
+    ).annotate(used_count=Count('pk'))
+    for row in used_counts:
+        next_indexes[row['crypto_upper']] = row['used_count']
+    for row in CryptoAddressPool.objects.values('crypto').annotate(last_index=Max('address_index')):
+        next_indexes[row['crypto']] = max(next_indexes.get(row['crypto'], 0), row['last_index'] + 1)
+    CryptoAddressSequence.objects.bulk_create(
+        [CryptoAddressSequence(crypto=crypto, next_index=next_index) for crypto, next_index in next_indexes.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0002_cryptoaddresspool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CryptoAddressSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('crypto', models.CharField(max_length=50, unique=True)),
+                ('next_index', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_address_sequences, migrations.RunPython.noop),
+    ]
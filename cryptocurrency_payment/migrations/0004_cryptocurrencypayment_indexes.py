@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0003_cryptoaddresssequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['crypto', 'status', 'created_at'], name='crypto_pay_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['crypto', 'status', 'updated_at'], name='crypto_pay_status_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(condition=models.Q(status__in=['new', 'processing', 'waiting']), fields=['crypto', 'created_at'], name='crypto_pay_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['address'], name='crypto_pay_address_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['tx_hash'], name='crypto_pay_tx_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0004_cryptocurrencypayment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cryptocurrencypayment',
+            name='lease_expires_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='cryptocurrencypayment',
+            name='lease_owner',
+            field=models.CharField(editable=False, max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['lease_owner'], name='crypto_pay_lease_owner_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0005_cryptocurrencypayment_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cryptocurrencypayment',
+            name='next_check_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['crypto', 'next_check_at'], name='crypto_pay_next_check_idx'),
+        ),
+    ]
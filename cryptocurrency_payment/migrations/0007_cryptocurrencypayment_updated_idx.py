@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0006_cryptocurrencypayment_next_check_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['crypto', 'updated_at'], name='crypto_pay_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0007_cryptocurrencypayment_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentTaskRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=50)),
+                ('crypto', models.CharField(max_length=50)),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='Seconds', null=True)),
+                ('rows_scanned', models.PositiveIntegerField(default=0)),
+                ('rows_changed', models.PositiveIntegerField(default=0)),
+                ('backend_calls', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymenttaskrun',
+            index=models.Index(fields=['task', 'crypto', 'started_at'], name='crypto_task_run_started_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymenttaskrun',
+            constraint=models.UniqueConstraint(condition=models.Q(finished_at__isnull=True), fields=('task', 'crypto', 'slot'), name='crypto_task_run_slot_uniq'),
+        ),
+    ]
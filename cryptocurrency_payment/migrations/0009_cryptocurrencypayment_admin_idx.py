@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptocurrency_payment', '0008_paymenttaskrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['created_at'], name='crypto_pay_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cryptocurrencypayment',
+            index=models.Index(fields=['status', 'created_at'], name='crypto_pay_status_idx'),
+        ),
+    ]
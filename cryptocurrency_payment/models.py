@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
+import copy
 from uuid import uuid4
 
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db import connections, IntegrityError, models, transaction
+from django.db.models import F, Max, Q
+from django.db.models.query import ModelIterable
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
 from cryptocurrency_payment.app_settings import get_backend_config, get_backend_obj
+from cryptocurrency_payment.metrics import timed
+from cryptocurrency_payment.rates import ExchangeRates
 
 
 def get_new_address(backend, index, address_type, derivation_path):
@@ -14,6 +24,80 @@ def get_new_address(backend, index, address_type, derivation_path):
     backend.wallet.from_path("{}/{}".format(derivation_path, str(index)))
     return backend.wallet.dumps()['addresses'][address_type.lower()]
 
+
+def get_new_addresses(backend, indexes, address_type, derivation_path):
+    """
+    Derive addresses for many indexes at once. The parent key on derivation_path is derived
+    once and each index is derived from it, addresses are the same as get_new_address
+    :param backend: Backend obj with a wallet
+    :param indexes: Address indexes to derive
+    :param address_type: p2pkh p2sh p2wpkh p2wsh p2wpkh_in_p2sh
+    :param derivation_path: Derivation path of the parent key
+    :return: list of addresses in the same order as indexes
+    """
+    backend.wallet.clean_derivation()
+    if derivation_path not in ("", "m", "m/"):
+        backend.wallet.from_path(derivation_path)
+    address_method = "{}_address".format(address_type.lower())
+    addresses = []
+    for index in indexes:
+        wallet = copy.copy(backend.wallet)
+        wallet.from_index(int(index))
+        addresses.append(getattr(wallet, address_method)())
+    return addresses
+
+
+def fill_address_pool(crypto, backend=None, size=None):
+    """
+    Derive new addresses into the address pool of a crypto until it holds size free addresses
+    :param crypto: The crypto in config
+    :param backend: Backend obj to derive with, one is gotten for crypto if not passed
+    :param size: Number of free addresses wanted, defaults to ADDRESS_POOL_SIZE
+    :return: Number of addresses added
+    """
+    size = size or get_backend_config(crypto, key="ADDRESS_POOL_SIZE")
+    address_type = get_backend_config(crypto, key="ADDRESS_TYPE")
+    derivation_path = get_backend_config(crypto, key="DERIVATION_PATH")
+    missing = size - CryptoAddressPool.get_free_count(crypto, address_type, derivation_path)
+    if missing <= 0:
+        return 0
+    backend = backend or get_backend_obj(crypto)
+    start_index = CryptoAddressSequence.allocate_index(crypto, count=missing)
+    indexes = range(start_index, start_index + missing)
+    with timed("get_new_addresses", crypto):
+        addresses = get_new_addresses(backend, indexes, address_type, derivation_path)
+    CryptoAddressPool.objects.bulk_create(
+        [
+            CryptoAddressPool(
+                crypto=crypto.upper(),
+                address_type=address_type.lower(),
+                derivation_path=derivation_path,
+                address_index=index,
+                address=address,
+            )
+            for index, address in zip(indexes, addresses)
+        ],
+        ignore_conflicts=True,
+    )
+    return missing
+
+
+def get_pool_address(crypto, backend=None):
+    """
+    Claim a free address from the address pool of a crypto. The pool is filled first when it is empty
+    :param crypto: The crypto in config
+    :param backend: Backend obj used if the pool needs filling
+    :return: address
+    """
+    address_type = get_backend_config(crypto, key="ADDRESS_TYPE")
+    derivation_path = get_backend_config(crypto, key="DERIVATION_PATH")
+    address = CryptoAddressPool.claim_address(crypto, address_type, derivation_path)
+    while address is None:
+        fill_address_pool(crypto, backend=backend)
+        address = CryptoAddressPool.claim_address(crypto, address_type, derivation_path)
+    return address
+
+
 def create_child_payment(payment, fiat_amount):
     """
     Create a child payment from a particular payment. A child payment can be created for a particular underpaid amount
@@ -36,6 +120,14 @@ def create_child_payment(payment, fiat_amount):
     return child_payment
 
 
+async def acreate_child_payment(payment, fiat_amount):
+    """
+    create_child_payment for async code, it runs in a thread so address derivation, price lookup and queries
+    do not block the event loop
+    """
+    return await sync_to_async(create_child_payment)(payment, fiat_amount)
+
+
 def create_new_payment(
     crypto,
     fiat_amount,
@@ -68,7 +160,7 @@ def create_new_payment(
     crypto_code = get_backend_config(crypto, key="CODE")
     backend_obj = get_backend_obj(crypto)
 
-    crypto_amount = backend_obj.convert_from_fiat(fiat_amount, fiat_currency)
+    crypto_amount = ExchangeRates(crypto, backend_obj).convert_from_fiat(fiat_amount, fiat_currency)
     address = None
     resuse_address = False
     related_object_id = None
@@ -80,14 +172,22 @@ def create_new_payment(
     if not address and crypto_reuse_address is True:
         address = CryptoCurrencyPayment.get_crypto_reused_address(crypto)
         resuse_address = address is not None
+    if not address and not address_index and get_backend_config(crypto, key="ADDRESS_POOL_SIZE"):
+        address = get_pool_address(crypto, backend=backend_obj)
     if not address:
         address_generated_count = (
-            address_index or CryptoCurrencyPayment.get_address_used_count(crypto)
+            address_index or CryptoAddressSequence.allocate_index(crypto)
         )
         get_backend_config(crypto, key="CODE")
         ADDRESS_TYPE = get_backend_config(crypto, key="ADDRESS_TYPE")
         DEVRIVATION_PATH = get_backend_config(crypto, key="DERIVATION_PATH")
-        address = get_new_address(backend=backend_obj, index=address_generated_count, address_type=ADDRESS_TYPE, derivation_path=DEVRIVATION_PATH)
+        with timed("get_new_address", crypto):
+            address = get_new_address(
+                backend=backend_obj,
+                index=address_generated_count,
+                address_type=ADDRESS_TYPE,
+                derivation_path=DEVRIVATION_PATH,
+            )
 
     payment = CryptoCurrencyPayment(
         crypto=crypto,
@@ -110,6 +210,182 @@ def create_new_payment(
     return payment
 
 
+def create_new_payments_bulk(crypto, items, batch_size=1000):
+    """
+    Create many payments of a crypto at once. The address indexes of all payments are reserved together,
+    addresses are derived batch_size at a time and payments are inserted with bulk_create. Amounts are converted
+    with one ExchangeRates, which fetches the rate of each currency once, so payments get the same address and
+    amount create_new_payment would give them. Addresses are derived from the address sequence even when the crypto
+    has an address pool and reused addresses are looked up once. No post_save is sent for bulk created payments
+    :param crypto: The crypto in config the payments belong to
+    :param items: dicts of create_new_payment keyword arguments, fiat_amount, fiat_currency, payment_title,
+     payment_description, related_object and user are supported
+    :param batch_size: Number of payments derived and inserted at a time
+    :return: list of payments in the order of items
+    """
+    items = list(items)
+    crypto_code = get_backend_config(crypto, key="CODE")
+    address_type = get_backend_config(crypto, key="ADDRESS_TYPE")
+    derivation_path = get_backend_config(crypto, key="DERIVATION_PATH")
+    backend_obj = get_backend_obj(crypto)
+    exchange_rates = ExchangeRates(crypto, backend_obj)
+    reused_address = None
+    if get_backend_config(crypto, key="REUSE_ADDRESS") is True:
+        reused_address = CryptoCurrencyPayment.get_crypto_reused_address(crypto)
+    start_index = None
+    if items and reused_address is None:
+        start_index = CryptoAddressSequence.allocate_index(crypto, count=len(items))
+    payments = []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        if reused_address is None:
+            indexes = range(start_index + start, start_index + start + len(batch))
+            with timed("get_new_addresses", crypto):
+                addresses = get_new_addresses(backend_obj, indexes, address_type, derivation_path)
+        else:
+            addresses = [reused_address] * len(batch)
+        batch_payments = []
+        for item, address in zip(batch, addresses):
+            fiat_amount = item["fiat_amount"]
+            fiat_currency = item["fiat_currency"]
+            related_object = item.get("related_object")
+            payment = CryptoCurrencyPayment(
+                crypto=crypto,
+                crypto_code=crypto_code,
+                address=address,
+                crypto_amount=exchange_rates.convert_from_fiat(fiat_amount, fiat_currency),
+                fiat_amount=fiat_amount,
+                fiat_currency=fiat_currency,
+                payment_title=item.get("payment_title"),
+                payment_description=item.get("payment_description"),
+                address_reused=reused_address is not None,
+                user=item.get("user"),
+                object_id=related_object.pk if related_object else None,
+                content_object=related_object,
+            )
+            if fiat_amount == 0:
+                payment.status = CryptoCurrencyPayment.PAYMENT_PAID
+            batch_payments.append(payment)
+        payments.extend(CryptoCurrencyPayment.objects.bulk_create(batch_payments))
+    return payments
+
+
+async def acreate_new_payment(*args, **kwargs):
+    """
+    create_new_payment for async code, it takes the same arguments and runs in a thread so address derivation,
+    price lookup and queries do not block the event loop
+    :return: payment obj
+    """
+    return await sync_to_async(create_new_payment)(*args, **kwargs)
+
+
+PAYMENT_CHAIN_SQL = """
+WITH RECURSIVE ancestors (id, parent_payment_id) AS (
+    SELECT {id}, {parent_payment_id} FROM {table} WHERE {id} IN ({pks})
+    UNION
+    SELECT payment.{id}, payment.{parent_payment_id} FROM {table} payment
+    INNER JOIN ancestors ON payment.{id} = ancestors.parent_payment_id
+),
+chain (id, root_id, depth) AS (
+    SELECT id, id, 0 FROM ancestors WHERE parent_payment_id IS NULL
+    UNION ALL
+    SELECT payment.{id}, chain.root_id, chain.depth + 1 FROM {table} payment
+    INNER JOIN chain ON payment.{parent_payment_id} = chain.id
+)
+SELECT payment.*, chain.root_id AS chain_root_id FROM {table} payment
+INNER JOIN chain ON payment.{id} = chain.id
+ORDER BY chain.root_id, chain.depth
+"""
+
+
+class CryptoCurrencyPaymentQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super(CryptoCurrencyPaymentQuerySet, self).__init__(*args, **kwargs)
+        self._with_chain = False
+
+    def _clone(self):
+        clone = super(CryptoCurrencyPaymentQuerySet, self)._clone()
+        clone._with_chain = self._with_chain
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(CryptoCurrencyPaymentQuerySet, self)._fetch_all()
+        if self._with_chain and not fetched and self._iterable_class is ModelIterable:
+            self.model.load_chains(self._result_cache)
+
+    def with_chain(self):
+        """
+        Load the underpayment chain of every payment with one more query when the queryset is evaluated,
+        see CryptoCurrencyPayment.get_chain. Not applied by iterator()
+        """
+        clone = self._chain()
+        clone._with_chain = True
+        return clone
+
+    def after(self, created_at, pk):
+        """
+        Payments ordered after a payment by created_at and id
+        """
+        return self.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+
+    def iter_chunks(self, chunk_size):
+        """
+        Iterate payments in lists of chunk_size ordered by created_at and id. Every chunk is fetched with its own
+        query starting after the last payment of the previous chunk, so only one chunk is held in memory
+        :param chunk_size: Number of payments in a chunk
+        :return: lists of payments
+        """
+        queryset = self.order_by("created_at", "pk")
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_payment = chunk[-1]
+            chunk = list(queryset.after(last_payment.created_at, last_payment.pk)[:chunk_size])
+
+    def due(self, now=None):
+        """
+        Payments whose next check is due
+        """
+        now = now or timezone.now()
+        return self.filter(Q(next_check_at__isnull=True) | Q(next_check_at__lte=now))
+
+    def unleased(self, now=None):
+        now = now or timezone.now()
+        return self.filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+
+    def claim(self, count, lease_seconds):
+        """
+        Lease up to count payments that no other worker holds, oldest first. Rows are locked with
+        SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, elsewhere the conditional update
+        of the lease decides which worker gets a row. A lease that is not released expires after lease_seconds
+        :param count: Number of payments to look at
+        :param lease_seconds: Lease duration
+        :return: lease token, leased payments, (created_at, id) of the last payment looked at or None if none were left
+        """
+        now = timezone.now()
+        lease_token = uuid4().hex
+        candidates = self.unleased(now).order_by("created_at", "pk")
+        with transaction.atomic(using=self.db):
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            candidate_rows = list(candidates.values_list("pk", "created_at")[:count])
+            if candidate_rows:
+                self.model.objects.using(self.db).filter(pk__in=[pk for pk, _ in candidate_rows]).unleased(
+                    now
+                ).update(lease_owner=lease_token, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        if not candidate_rows:
+            return lease_token, [], None
+        leased = list(self.model.objects.using(self.db).filter(lease_owner=lease_token).order_by("created_at", "pk"))
+        last_pk, last_created_at = candidate_rows[-1]
+        return lease_token, leased, (last_created_at, last_pk)
+
+    def release(self, lease_token):
+        return self.filter(lease_owner=lease_token).update(lease_owner=None, lease_expires_at=None)
+
+
 class CryptoCurrencyPayment(models.Model):
     """
     Cryptocurrencypayment model to handle all cryptocurrency transactions and transaction status
@@ -129,6 +405,7 @@ class CryptoCurrencyPayment(models.Model):
         (PAYMENT_CANCELLED, "Cancelled"),
         (PAYMENT_PROCESSING, "Processing"),
     )
+    OPEN_STATUSES = (PAYMENT_NEW, PAYMENT_PROCESSING, PAYMENT_WAIT)
     id = models.UUIDField(
         default=uuid4, editable=False, primary_key=True, verbose_name="ID",
     )
@@ -175,6 +452,29 @@ class CryptoCurrencyPayment(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    next_check_at = models.DateTimeField(null=True, editable=False)
+    lease_owner = models.CharField(max_length=32, null=True, editable=False)
+    lease_expires_at = models.DateTimeField(null=True, editable=False)
+
+    objects = CryptoCurrencyPaymentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["crypto", "status", "created_at"], name="crypto_pay_status_created_idx"),
+            models.Index(fields=["crypto", "status", "updated_at"], name="crypto_pay_status_updated_idx"),
+            models.Index(
+                fields=["crypto", "created_at"],
+                name="crypto_pay_open_idx",
+                condition=Q(status__in=["new", "processing", "waiting"]),
+            ),
+            models.Index(fields=["address"], name="crypto_pay_address_idx"),
+            models.Index(fields=["tx_hash"], name="crypto_pay_tx_hash_idx"),
+            models.Index(fields=["lease_owner"], name="crypto_pay_lease_owner_idx"),
+            models.Index(fields=["crypto", "next_check_at"], name="crypto_pay_next_check_idx"),
+            models.Index(fields=["crypto", "updated_at"], name="crypto_pay_updated_idx"),
+            models.Index(fields=["created_at"], name="crypto_pay_created_idx"),
+            models.Index(fields=["status", "created_at"], name="crypto_pay_status_idx"),
+        ]
 
     def __str__(self):
         return "{} {} {} {}".format(
@@ -207,6 +507,83 @@ class CryptoCurrencyPayment(models.Model):
         """
         return cls.objects.filter(crypto=crypto).count()
 
+    @classmethod
+    def load_chains(cls, payments):
+        """
+        Load the underpayment chains of payments with one recursive query. Each payment gets its chain from the
+        first payment to the last child payment, the parent and child payment of every payment of a chain
+        are set from it so walking the chain does not query again
+        :param payments: Payments to load chains for
+        :return:
+        """
+        payments = list(payments)
+        if not payments:
+            return
+        using = payments[0]._state.db or "default"
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        sql = PAYMENT_CHAIN_SQL.format(
+            table=quote_name(cls._meta.db_table),
+            id=quote_name(cls._meta.pk.column),
+            parent_payment_id=quote_name(cls._meta.get_field("parent_payment").column),
+            pks=", ".join(["%s"] * len(payments)),
+        )
+        params = [cls._meta.pk.get_db_prep_value(payment.pk, connection) for payment in payments]
+        chains = {}
+        chain_roots = {}
+        for chain_payment in cls.objects.db_manager(using).raw(sql, params):
+            chains.setdefault(chain_payment.chain_root_id, []).append(chain_payment)
+            chain_roots[chain_payment.pk] = chain_payment.chain_root_id
+        for chain in chains.values():
+            for parent_payment, child_payment in zip(chain, chain[1:]):
+                cls.set_chain_links(parent_payment, child_payment)
+            cls.set_chain_links(None, chain[0])
+            cls.set_chain_links(chain[-1], None)
+            for chain_payment in chain:
+                chain_payment._chain = chain
+        for payment in payments:
+            chain = chains.get(chain_roots.get(payment.pk), [payment])
+            index = [chain_payment.pk for chain_payment in chain].index(payment.pk)
+            payment._chain = chain
+            if index:
+                cls.set_chain_links(chain[index - 1], payment)
+            if index + 1 < len(chain):
+                cls.set_chain_links(payment, chain[index + 1])
+
+    @staticmethod
+    def set_chain_links(parent_payment, child_payment):
+        """
+        Cache child_payment of parent_payment and parent_payment of child_payment where their ids agree
+        """
+        if parent_payment is not None and parent_payment.child_payment_id == getattr(child_payment, "pk", None):
+            parent_payment._state.fields_cache["child_payment"] = child_payment
+        if child_payment is not None and child_payment.parent_payment_id == getattr(parent_payment, "pk", None):
+            child_payment._state.fields_cache["parent_payment"] = parent_payment
+
+    def get_chain(self):
+        """
+        The underpayment chain of this payment, from the first payment to its last child payment
+        :return: list of payments
+        """
+        if not hasattr(self, "_chain"):
+            self.load_chains([self])
+        return self._chain
+
+    def get_chain_totals(self):
+        """
+        Totals of the underpayment chain of this payment
+        :return: dict with the crypto_amount of the first payment, paid_crypto_amount of every payment and
+         remaining_crypto_amount of the last payment
+        """
+        chain = self.get_chain()
+        return {
+            "payments": len(chain),
+            "crypto_amount": chain[0].crypto_amount,
+            "paid_crypto_amount": sum((payment.paid_crypto_amount for payment in chain), Decimal(0)),
+            "remaining_crypto_amount": chain[-1].remaining_crypto_amount or Decimal(0),
+            "status": chain[-1].status,
+        }
+
     @property
     def remaining_crypto_amount(self):
         if self.crypto_amount > self.paid_crypto_amount:
@@ -217,3 +594,194 @@ class CryptoCurrencyPayment(models.Model):
         if self.paid_crypto_amount and self.remaining_crypto_amount:
             return True
         return False
+
+
+class CryptoAddressPool(models.Model):
+    """
+    Addresses derived ahead of time so payments can claim one without deriving a key.
+    There is one pool per crypto, address type and derivation path, a claimed address has claimed_at set
+    """
+
+    CLAIM_RETRIES = 5
+
+    crypto = models.CharField(max_length=50)
+    address_type = models.CharField(max_length=20)
+    derivation_path = models.CharField(max_length=100)
+    address_index = models.PositiveIntegerField()
+    address = models.CharField(max_length=200)
+    claimed_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("crypto", "address_type", "derivation_path", "address_index")
+        indexes = [
+            models.Index(
+                fields=["crypto", "address_type", "derivation_path", "claimed_at", "address_index"],
+                name="crypto_pool_free_idx",
+            )
+        ]
+
+    def __str__(self):
+        return "{} {} {}".format(self.crypto, self.address_index, self.address)
+
+    @classmethod
+    def get_pool(cls, crypto, address_type, derivation_path):
+        return cls.objects.filter(
+            crypto=crypto.upper(),
+            address_type=address_type.lower(),
+            derivation_path=derivation_path,
+        )
+
+    @classmethod
+    def get_free_count(cls, crypto, address_type, derivation_path):
+        return cls.get_pool(crypto, address_type, derivation_path).filter(claimed_at__isnull=True).count()
+
+    @classmethod
+    def claim_address(cls, crypto, address_type, derivation_path):
+        """
+        Claim the free address with the lowest index with a single conditional update,
+        a row taken by another worker in between is skipped
+        :return: address or None when the pool is empty
+        """
+        free_addresses = cls.get_pool(crypto, address_type, derivation_path).filter(claimed_at__isnull=True)
+        for _ in range(cls.CLAIM_RETRIES):
+            entry = free_addresses.order_by("address_index").values_list("pk", "address").first()
+            if entry is None:
+                return None
+            pk, address = entry
+            if cls.objects.filter(pk=pk, claimed_at__isnull=True).update(claimed_at=timezone.now()):
+                return address
+        return None
+
+
+class CryptoAddressSequence(models.Model):
+    """
+    Next address index to derive for a crypto. Indexes are handed out by incrementing the row
+    so concurrent payments never get the same address
+    """
+
+    crypto = models.CharField(max_length=50, unique=True)
+    next_index = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} {}".format(self.crypto, self.next_index)
+
+    @classmethod
+    def get_initial_index(cls, crypto):
+        """
+        Get the index a new sequence starts from, after the addresses already generated for the crypto
+        :param crypto:
+        :return: index
+        """
+        last_pool_index = CryptoAddressPool.objects.filter(crypto=crypto.upper()).aggregate(
+            last_index=Max("address_index")
+        )["last_index"]
+        used_count = CryptoCurrencyPayment.objects.filter(crypto__iexact=crypto).count()
+        if last_pool_index is None:
+            return used_count
+        return max(used_count, last_pool_index + 1)
+
+    @classmethod
+    def allocate_index(cls, crypto, count=1):
+        """
+        Reserve count consecutive address indexes for a crypto. The row is incremented before it is read
+        so the reservation holds the row lock until the transaction ends
+        :param crypto:
+        :param count: Number of indexes to reserve
+        :return: First reserved index
+        """
+        crypto = crypto.upper()
+        with transaction.atomic():
+            if not cls.objects.filter(crypto=crypto).update(next_index=F("next_index") + count):
+                cls.objects.get_or_create(crypto=crypto, defaults={"next_index": cls.get_initial_index(crypto)})
+                cls.objects.filter(crypto=crypto).update(next_index=F("next_index") + count)
+            next_index = cls.objects.filter(crypto=crypto).values_list("next_index", flat=True).get()
+        return next_index - count
+
+
+class PaymentTaskRun(models.Model):
+    """
+    Record of a run of a payment task for a crypto with its timing and what it did. A run in progress holds one of the
+    TASK_RUN_CONCURRENCY slots of its task and crypto, a run that cannot get a slot is skipped
+    """
+
+    RUN_RUNNING = "running"
+    RUN_FINISHED = "finished"
+    RUN_FAILED = "failed"
+
+    RUN_STATUS = (
+        (RUN_RUNNING, "Running"),
+        (RUN_FINISHED, "Finished"),
+        (RUN_FAILED, "Failed"),
+    )
+
+    STAT_FIELDS = ("rows_scanned", "rows_changed", "backend_calls", "errors")
+
+    task = models.CharField(max_length=50)
+    crypto = models.CharField(max_length=50)
+    slot = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=RUN_STATUS, default=RUN_RUNNING)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+    rows_scanned = models.PositiveIntegerField(default=0)
+    rows_changed = models.PositiveIntegerField(default=0)
+    backend_calls = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "crypto", "slot"],
+                condition=Q(finished_at__isnull=True),
+                name="crypto_task_run_slot_uniq",
+            )
+        ]
+        indexes = [models.Index(fields=["task", "crypto", "started_at"], name="crypto_task_run_started_idx")]
+
+    def __str__(self):
+        return "{} {} {}".format(self.task, self.crypto, self.started_at)
+
+    @classmethod
+    def start(cls, task, crypto, concurrency=1, timeout=3600):
+        """
+        Start a run if fewer than concurrency runs of the task and crypto are in progress. Runs that are still
+        in progress after timeout seconds are marked failed first, their worker is assumed gone
+        :param task: Task name
+        :param crypto: The crypto in config
+        :param concurrency: Runs of the task and crypto allowed at the same time
+        :param timeout: Seconds after which a run in progress is stale
+        :return: run or None when the run has to be skipped
+        """
+        crypto = crypto.upper()
+        now = timezone.now()
+        if timeout:
+            cls.objects.filter(
+                task=task, crypto=crypto, finished_at__isnull=True, started_at__lt=now - timedelta(seconds=timeout)
+            ).update(status=cls.RUN_FAILED, finished_at=now)
+        for slot in range(concurrency):
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(task=task, crypto=crypto, slot=slot, started_at=now)
+            except IntegrityError:
+                continue
+        return None
+
+    def finish(self, stats, failed=False):
+        """
+        Save the outcome of the run and free its slot
+        :param stats: Counts of the run for STAT_FIELDS
+        :param failed: The run raised
+        :return:
+        """
+        self.finished_at = timezone.now()
+        self.duration = (self.finished_at - self.started_at).total_seconds()
+        self.status = self.RUN_FAILED if failed else self.RUN_FINISHED
+        for field in self.STAT_FIELDS:
+            setattr(self, field, stats.get(field, 0))
+        type(self).objects.filter(pk=self.pk, finished_at__isnull=True).update(
+            finished_at=self.finished_at,
+            duration=self.duration,
+            status=self.status,
+            **{field: getattr(self, field) for field in self.STAT_FIELDS}
+        )
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+from decimal import Decimal
+from urllib.parse import quote, urlencode
+
+from django.shortcuts import reverse
+
+try:
+    import segno
+except ImportError:  # pragma: no cover
+    segno = None
+
+QR_CACHE_KEY = "cryptocurrency_payment:qr:{}"
+QR_CACHE_TTL = 30 * 24 * 60 * 60
+EXTERNAL_QR_URL = "https://chart.googleapis.com/chart?chs=100x100&cht=qr&chl={}"
+
+
+def get_payment_uri(scheme, address, crypto_amount, label=None, message=None):
+    """
+    Build the BIP21 URI of a payment e.g bitcoin:address?amount=0.1&label=Order%201, spaces are percent-encoded
+    as BIP21 wallets do not decode +
+    :return: uri
+    """
+    params = [("amount", "{:f}".format(Decimal(str(crypto_amount)).normalize()))]
+    if label:
+        params.append(("label", label))
+    if message:
+        params.append(("message", message))
+    return "{}:{}?{}".format(scheme, address, urlencode(params, quote_via=quote))
+
+
+def get_qr_digest(uri):
+    return hashlib.sha256(uri.encode("utf-8")).hexdigest()[:32]
+
+
+def get_qr_url(pk, uri):
+    """
+    URL of the QR code of a payment. The URL changes with the QR code content so it can be cached for long,
+    without segno installed the QR code is drawn by an external service
+    :param pk: Payment id
+    :param uri: Payment URI
+    :return: url
+    """
+    if segno is None:
+        return EXTERNAL_QR_URL.format(quote(uri, safe=""))
+    return "{}?v={}".format(reverse("cryptocurrency_payment:crypto_payment_qr", args=(pk,)), get_qr_digest(uri))
+
+
+def make_qr_svg(uri, scale=4):
+    """
+    Draw a QR code of uri as SVG, needs segno
+    :return: svg bytes
+    """
+    if segno is None:
+        raise ImportError("segno is needed to draw QR codes, pip install segno")
+    svg = io.BytesIO()
+    segno.make(uri, error="m").save(svg, kind="svg", scale=scale, border=2, xmldecl=False)
+    return svg.getvalue()
+
+
+def get_qr_svg(uri, cache):
+    """
+    QR code SVG of uri from cache, drawn and cached by the digest of uri when missing
+    :param uri: Content of the QR code
+    :param cache: Django cache to keep QR codes in
+    :return: svg bytes
+    """
+    cache_key = QR_CACHE_KEY.format(get_qr_digest(uri))
+    svg = cache.get(cache_key)
+    if svg is None:
+        svg = make_qr_svg(uri)
+        cache.set(cache_key, svg, QR_CACHE_TTL)
+    return svg
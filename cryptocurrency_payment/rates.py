@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal
+
+from django.core.cache import caches
+
+from cryptocurrency_payment.app_settings import get_backend_config, get_backend_obj
+from cryptocurrency_payment.metrics import timed
+
+RATE_CACHE_KEY = "cryptocurrency_payment:exchange_rate:{}:{}"
+RATE_SAMPLE_AMOUNT = Decimal(10000)
+FIAT_PLACES = Decimal("0.01")
+
+
+def fetch_exchange_rate(backend, fiat_currency):
+    """
+    Get the fiat price of one crypto unit from a backend. Backends can implement get_exchange_rate,
+    for others the rate is read from convert_to_fiat on a large amount so its rounding does not cut the rate
+    :param backend: Backend obj
+    :param fiat_currency: Fiat currency of the rate
+    :return: Decimal rate
+    """
+    if hasattr(backend, "get_exchange_rate"):
+        return Decimal(str(backend.get_exchange_rate(fiat_currency)))
+    return Decimal(str(backend.convert_to_fiat(RATE_SAMPLE_AMOUNT, fiat_currency))) / RATE_SAMPLE_AMOUNT
+
+
+class ExchangeRates:
+    """
+    Exchange rates of one crypto. Each fiat currency rate is fetched once for the life of the object, so a task run
+    or a bulk creation uses one rate per currency, and conversions are done in Decimal from that rate.
+    With EXCHANGE_RATE_TTL set rates are also shared with other workers through the EXCHANGE_RATE_CACHE
+    """
+
+    def __init__(self, crypto, backend=None):
+        self.crypto = crypto.upper()
+        self.backend = backend or get_backend_obj(crypto)
+        self.ttl = get_backend_config(crypto, "EXCHANGE_RATE_TTL")
+        self.cache = caches[get_backend_config(crypto, "EXCHANGE_RATE_CACHE")]
+        self.crypto_places = Decimal(1).scaleb(-get_backend_config(crypto, "CRYPTO_DECIMAL_PLACES"))
+        self.rates = {}
+
+    def get_rate(self, fiat_currency):
+        fiat_currency = fiat_currency.upper()
+        if fiat_currency not in self.rates:
+            cache_key = RATE_CACHE_KEY.format(self.crypto, fiat_currency)
+            rate = self.cache.get(cache_key) if self.ttl else None
+            if rate is None:
+                rate = fetch_exchange_rate(self.backend, fiat_currency)
+                if self.ttl:
+                    self.cache.set(cache_key, str(rate), self.ttl)
+            self.rates[fiat_currency] = Decimal(rate)
+        return self.rates[fiat_currency]
+
+    def convert_from_fiat(self, amount, fiat_currency):
+        with timed("convert_from_fiat", self.crypto):
+            return (Decimal(str(amount)) / self.get_rate(fiat_currency)).quantize(self.crypto_places)
+
+    def convert_to_fiat(self, amount, fiat_currency):
+        with timed("convert_to_fiat", self.crypto):
+            return (Decimal(str(amount)) * self.get_rate(fiat_currency)).quantize(FIAT_PLACES)
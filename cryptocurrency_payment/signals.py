@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+from django.dispatch import Signal
+
+# Sent after an instrumented operation with crypto, operation, duration in seconds and error,
+# True when the operation raised
+operation_timed = Signal()
+
+# Sent when payments change status with crypto, old_status, new_status and count of payments
+payment_status_changed = Signal()
@@ -0,0 +1,124 @@
+/*
+ * Keep a payment page up to date without reloading it. The frame needs data-status-url and can set
+ * data-events-url and data-poll-interval in milliseconds.
+ * Browsers with EventSource subscribe to the events stream, others poll status.json with the last ETag
+ * so an unchanged payment is answered with an empty 304.
+ */
+(function () {
+  "use strict";
+
+  var CLOSED_STATUSES = ["paid", "cancelled"];
+  var TX_URL = "https://live.blockcypher.com/btc/tx/";
+
+  function setText(frame, selector, value) {
+    var elements = frame.querySelectorAll(selector);
+    for (var i = 0; i < elements.length; i++) {
+      elements[i].textContent = value === null || value === undefined ? "" : value;
+    }
+  }
+
+  function title(value) {
+    return value.charAt(0).toUpperCase() + value.slice(1);
+  }
+
+  function truncate(value, length) {
+    return value.length > length ? value.slice(0, length - 1) + "…" : value;
+  }
+
+  function isClosed(payment) {
+    return CLOSED_STATUSES.indexOf(payment.status) !== -1;
+  }
+
+  function update(frame, payment) {
+    setText(frame, ".abf-status", title(payment.status));
+    setText(frame, ".abf-totalbtc", payment.crypto_amount);
+    setText(frame, ".abf-arrived", payment.paid_crypto_amount);
+    setText(frame, ".abf-remains", payment.remaining_crypto_amount);
+
+    var qrImage = frame.querySelector(".abf-qr img");
+    if (qrImage && payment.qr_url && qrImage.getAttribute("src") !== payment.qr_url) {
+      qrImage.src = payment.qr_url;
+    }
+    var uriLink = frame.querySelector(".abf-input-address a");
+    if (uriLink && payment.payment_uri) {
+      uriLink.href = payment.payment_uri;
+    }
+
+    var txBlock = frame.querySelector(".abf-tx-block");
+    if (txBlock && payment.tx_hash) {
+      var txLink = txBlock.querySelector("a");
+      txLink.href = TX_URL + payment.tx_hash + "/";
+      txLink.textContent = truncate(payment.tx_hash, 25);
+      txBlock.hidden = false;
+    }
+    var child = frame.querySelector(".abf-child-payment");
+    if (child && payment.child_payment_url) {
+      child.querySelector("a").href = payment.child_payment_url;
+      child.hidden = false;
+    }
+  }
+
+  function subscribe(frame) {
+    var source = new EventSource(frame.getAttribute("data-events-url"));
+    source.addEventListener("status", function (event) {
+      var payment = JSON.parse(event.data);
+      update(frame, payment);
+      if (isClosed(payment)) {
+        source.close();
+      }
+    });
+  }
+
+  function poll(frame) {
+    var url = frame.getAttribute("data-status-url");
+    var interval = parseInt(frame.getAttribute("data-poll-interval"), 10) || 10000;
+    var etag = null;
+
+    function schedule() {
+      window.setTimeout(check, interval);
+    }
+
+    function check() {
+      var headers = {"Accept": "application/json"};
+      if (etag) {
+        headers["If-None-Match"] = etag;
+      }
+      fetch(url, {headers: headers, cache: "no-store", credentials: "same-origin"}).then(function (response) {
+        if (response.status === 304) {
+          return null;
+        }
+        if (!response.ok) {
+          throw new Error("status " + response.status);
+        }
+        etag = response.headers.get("ETag");
+        return response.json();
+      }).then(function (payment) {
+        if (payment) {
+          update(frame, payment);
+        }
+        if (!payment || !isClosed(payment)) {
+          schedule();
+        }
+      }).catch(schedule);
+    }
+
+    check();
+  }
+
+  function start() {
+    var frames = document.querySelectorAll("[data-status-url]");
+    for (var i = 0; i < frames.length; i++) {
+      if (window.EventSource && frames[i].getAttribute("data-events-url")) {
+        subscribe(frames[i]);
+      } else {
+        poll(frames[i]);
+      }
+    }
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", start);
+  } else {
+    start();
+  }
+})();
@@ -1,8 +1,19 @@
-from cryptocurrency_payment.models import CryptoCurrencyPayment
+import asyncio
+from asgiref.sync import sync_to_async
+from cryptocurrency_payment.models import CryptoCurrencyPayment, CryptoAddressPool, PaymentTaskRun
+from django.db.models import Count
 from django.utils import timezone
-from cryptocurrency_payment.models import create_child_payment
+from cryptocurrency_payment.models import create_child_payment, fill_address_pool
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import threading
 from cryptocurrency_payment.app_settings import get_active_backends, get_backend_config, get_backend_obj
+from cryptocurrency_payment.metrics import timed, timed_method
+from cryptocurrency_payment.rates import ExchangeRates
+from cryptocurrency_payment.signals import payment_status_changed
+
+POLL_MAX_BACKOFF_DOUBLINGS = 10
 
 
 def update_payment_status():
@@ -13,29 +24,61 @@ def update_payment_status():
     backends = get_active_backends()
     for backend in backends:
         crypto_task = CryptoCurrencyPaymentTask(backend)
-        crypto_task.update_crypto_currency_payment_status()
+        crypto_task.run("update_payment_status", crypto_task.update_crypto_currency_payment_status)
+
+
+async def aupdate_payment_status():
+    """
+    update_payment_status for an asyncio loop. Backends are polled together on the loop and database
+    work runs in a thread, see CryptoCurrencyPaymentTask.aupdate_payments_status
+    :return:
+    """
+    crypto_tasks = [CryptoCurrencyPaymentTask(backend) for backend in get_active_backends()]
+    await asyncio.gather(
+        *[
+            crypto_task.arun("update_payment_status", crypto_task.aupdate_crypto_currency_payment_status)
+            for crypto_task in crypto_tasks
+        ]
+    )
 
 
 def cancel_unpaid_payment():
     """
     Run this as a task to cancel payment that have stayed in new or waiting for too long
-    :return:
+    :return: Number of cancelled payments for each backend, None for skipped runs
     """
+    cancelled = {}
     backends = get_active_backends()
     for backend in backends:
         crypto_task = CryptoCurrencyPaymentTask(backend)
-        crypto_task.cancel_unpaid_payment()
+        cancelled[backend] = crypto_task.run("cancel_unpaid_payment", crypto_task.cancel_unpaid_payment)
+    return cancelled
 
 
 def refresh_payment_prices():
     """
     Payment prices can be renewed periodically according to the latest conversion rate using this method
+    :return: Number of refreshed payments for each backend, None for skipped runs
+    """
+    refreshed = {}
+    backends = get_active_backends()
+    for backend in backends:
+        crypto_task = CryptoCurrencyPaymentTask(backend)
+        refreshed[backend] = crypto_task.run("refresh_payment_prices", crypto_task.refresh_new_crypto_payment_amount)
+    return refreshed
+
+
+def refill_address_pool():
+    """
+    Run this as a task periodically to keep pre derived addresses in the address pool of backends using one
     :return:
     """
     backends = get_active_backends()
     for backend in backends:
+        if not get_backend_config(backend, "ADDRESS_POOL_SIZE"):
+            continue
         crypto_task = CryptoCurrencyPaymentTask(backend)
-        crypto_task.refresh_new_crypto_payment_amount()
+        crypto_task.run("refill_address_pool", crypto_task.refill_address_pool)
 
 
 class CryptoCurrencyPaymentTask:
@@ -44,6 +87,8 @@ class CryptoCurrencyPaymentTask:
     Update unpaid payment status and refresh unpaid payment prices
     """
 
+    CHUNK_SIZE = 500
+
     def __init__(self, crypto):
 
         self.unpaid_payment_hrs = get_backend_config(
@@ -66,88 +111,541 @@ class CryptoCurrencyPaymentTask:
         self.confirm_bal_without_hash_mins = get_backend_config(
             crypto, "IGNORE_CONFIRMED_BALANCE_WITHOUT_SAVED_HASH_MINS"
         )
+        self.poll_concurrency = get_backend_config(crypto, "POLL_CONCURRENCY")
+        self.poll_batch_size = get_backend_config(crypto, "POLL_BATCH_SIZE")
+        self.poll_lease_seconds = get_backend_config(crypto, "POLL_LEASE_SECONDS")
+        self.block_interval_seconds = get_backend_config(crypto, "BLOCK_INTERVAL_SECONDS")
+        self.poll_min_interval_seconds = get_backend_config(crypto, "POLL_MIN_INTERVAL_SECONDS")
+        self.poll_max_interval_seconds = get_backend_config(crypto, "POLL_MAX_INTERVAL_SECONDS")
+        self.poll_backoff_after_seconds = get_backend_config(crypto, "POLL_BACKOFF_AFTER_SECONDS")
+        self.notify_poll_delay_seconds = get_backend_config(crypto, "NOTIFY_POLL_DELAY_SECONDS")
+        self.ingest_source = get_backend_config(crypto, "INGEST_SOURCE")
+        self.task_run_concurrency = get_backend_config(crypto, "TASK_RUN_CONCURRENCY")
+        self.task_run_timeout_seconds = get_backend_config(crypto, "TASK_RUN_TIMEOUT_SECONDS")
+        self.async_poll_concurrency = get_backend_config(crypto, "ASYNC_POLL_CONCURRENCY")
+        self.exchange_rates = ExchangeRates(crypto, self.backend_obj)
+        self.run_stats = Counter()
+        self.run_stats_lock = threading.Lock()
 
+    def run(self, task, method, *args, **kwargs):
+        """
+        Run a task method recorded as a PaymentTaskRun. The run is skipped when TASK_RUN_CONCURRENCY runs of the task
+        are already in progress for the crypto
+        :param task: Task name of the run
+        :param method: Task method to run
+        :return: Result of method or None when the run was skipped
+        """
+        task_run = PaymentTaskRun.start(task, self.crypto, self.task_run_concurrency, self.task_run_timeout_seconds)
+        if task_run is None:
+            return None
+        self.run_stats = Counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            self.count("errors")
+            task_run.finish(self.run_stats, failed=True)
+            raise
+        task_run.finish(self.run_stats)
+        return result
+
+    async def arun(self, task, method, *args, **kwargs):
+        """
+        run for a coroutine method
+        """
+        task_run = await sync_to_async(PaymentTaskRun.start)(
+            task, self.crypto, self.task_run_concurrency, self.task_run_timeout_seconds
+        )
+        if task_run is None:
+            return None
+        self.run_stats = Counter()
+        try:
+            result = await method(*args, **kwargs)
+        except Exception:
+            self.count("errors")
+            await sync_to_async(task_run.finish)(self.run_stats, failed=True)
+            raise
+        await sync_to_async(task_run.finish)(self.run_stats)
+        return result
+
+    def count(self, stat, value=1):
+        """
+        Add to a count of the current run, see PaymentTaskRun.STAT_FIELDS
+        """
+        with self.run_stats_lock:
+            self.run_stats[stat] += value
+
+    @timed_method("update_payment_status")
     def update_crypto_currency_payment_status(self):
         """
         Get all payment that are in new status or processing status and check their status on
         the blockchain for confirmation. Only payment that are still in this particular status
-        are checked
+        are checked and only once their next_check_at is due, see get_next_check_at.
+        When the crypto has an INGEST_SOURCE new and waiting payments are left to the block scanner
+        and only processing payments are checked.
 
         :return:
         """
+        self.update_payments_status(self.get_due_payments())
+
+    @timed_method("update_payment_status")
+    async def aupdate_crypto_currency_payment_status(self):
+        """
+        update_crypto_currency_payment_status for an asyncio loop, see aupdate_payments_status
+        """
+        await self.aupdate_payments_status(self.get_due_payments())
+
+    def get_due_payments(self):
+        """
+        Open payments whose check is due, only processing payments when the crypto has an INGEST_SOURCE
+        :return: Queryset of payments
+        """
         yesterday_time = timezone.now() - timedelta(hours=self.unpaid_payment_hrs)
-        payments = CryptoCurrencyPayment.objects.filter(
+        statuses = CryptoCurrencyPayment.OPEN_STATUSES
+        if self.ingest_source:
+            statuses = [CryptoCurrencyPayment.PAYMENT_PROCESSING]
+        return CryptoCurrencyPayment.objects.filter(
             crypto=self.crypto,
-            status__in=[
-                CryptoCurrencyPayment.PAYMENT_NEW,
-                CryptoCurrencyPayment.PAYMENT_PROCESSING,
-                CryptoCurrencyPayment.PAYMENT_WAIT
-            ],
+            status__in=statuses,
             created_at__gte=yesterday_time,
-        ).all()
+        ).due()
+
+    @timed_method("update_notified_payment_status")
+    def update_notified_payment_status(self, addresses):
+        """
+        Check open payments of addresses a node or explorer notified a transaction for. The periodic
+        status update skips these payments for NOTIFY_POLL_DELAY_SECONDS after they are checked
+        :param addresses: Notified addresses
+        :return: Number of payments checked
+        """
+        payments = CryptoCurrencyPayment.objects.filter(
+            crypto=self.crypto,
+            status__in=CryptoCurrencyPayment.OPEN_STATUSES,
+            address__in=list(addresses),
+        )
+        return self.update_payments_status(payments, notified=True)
+
+    def update_payments_status(self, payments, notified=False, confirm_payments=None):
+        """
+        Check payments on the blockchain. Payments are leased CHUNK_SIZE at a time so several workers can run this
+        together, payments leased by another worker are skipped. Payments of a chunk sharing an address
+        are checked with one query, see confirm_payments.
+        With POLL_CONCURRENCY above 1 the blockchain is queried from a thread pool,
+        payments are still updated one after another from this thread. A payment the backend failed on is counted
+        in the run errors and left for the next run
+        :param payments: Queryset of payments to check
+        :param notified: The payments are checked because of a notification
+        :param confirm_payments: Function returning (payment, (status, value)) for a chunk of payments,
+         confirm_payments queries the backend
+        :return: Number of payments checked
+        """
+        confirm_payments = confirm_payments or self.confirm_payments
+        self.exchange_rates = ExchangeRates(self.crypto, self.backend_obj)
+        payments = self.get_run_payments(payments)
+        checked = 0
+        while True:
+            lease_token, chunk, payments = self.claim_chunk(payments)
+            if payments is None:
+                return checked
+            try:
+                checked += self.update_confirmed_payments(confirm_payments(chunk), notified=notified)
+            finally:
+                CryptoCurrencyPayment.objects.release(lease_token)
+
+    def get_run_payments(self, payments):
+        """
+        Payments created before the run started. Payments created while the run checks others, such as the child
+        payment of an underpaid payment, are left to the next run
+        :param payments: Queryset of payments to check
+        :return: Queryset of payments
+        """
+        return payments.filter(created_at__lte=timezone.now())
+
+    def claim_chunk(self, payments):
+        """
+        Lease the next CHUNK_SIZE payments of a run, see CryptoCurrencyPaymentQuerySet.claim
+        :param payments: Queryset of the payments left in the run
+        :return: lease token, leased payments, queryset of the payments after them or None when none were left
+        """
+        lease_token, chunk, last_payment = payments.claim(self.CHUNK_SIZE, self.poll_lease_seconds)
+        if last_payment is None:
+            return lease_token, chunk, None
+        self.count("rows_scanned", len(chunk))
+        return lease_token, chunk, payments.after(*last_payment)
+
+    async def aupdate_payments_status(self, payments, notified=False):
+        """
+        update_payments_status for an asyncio loop. The backend is queried for a whole chunk at the same time
+        from the loop, at most ASYNC_POLL_CONCURRENCY queries at once. Backends can implement
+        a coroutine aconfirm_address_payment taking the confirm_address_payment arguments, other backends are
+        queried from threads. Leasing and saving payments run in a thread
+        :param payments: Queryset of payments to check
+        :param notified: The payments are checked because of a notification
+        :return: Number of payments checked
+        """
+        self.exchange_rates = ExchangeRates(self.crypto, self.backend_obj)
+        self.async_poll_semaphore = asyncio.Semaphore(self.async_poll_concurrency)
+        payments = self.get_run_payments(payments)
+        checked = 0
+        while True:
+            lease_token, chunk, payments = await sync_to_async(self.claim_chunk)(payments)
+            if payments is None:
+                return checked
+            try:
+                confirmed = await self.aconfirm_payments(chunk)
+                checked += await sync_to_async(self.update_confirmed_payments)(confirmed, notified=notified)
+            finally:
+                await sync_to_async(CryptoCurrencyPayment.objects.release)(lease_token)
+
+    def update_confirmed_payments(self, confirmed, notified=False):
+        """
+        Save payments with their confirm result, payments without one are left as they are
+        :param confirmed: (payment, (status, value) or None) pairs
+        :param notified: The payments were checked because of a notification
+        :return: Number of payments saved
+        """
+        updated = 0
+        for payment, result in confirmed:
+            if result is None:
+                continue
+            status, value = result
+            self.update_payment(payment, status, value, notified=notified)
+            updated += 1
+        return updated
+
+    def confirm_payments(self, payments):
+        """
+        Query the backend once for payments sharing an address and transaction hash. The oldest payment of a group
+        is queried and its result is used for the rest of the group when the status does not depend on the amount
+        or the amounts are equal, any other payment of the group is queried on its own
+        :param payments: Payments to confirm, oldest first
+        :return: (payment, (status, value)) for every payment, group after group in order of their oldest payment.
+         The result is None for payments the backend failed on
+        """
+        groups = self.group_payments(payments)
+        representatives = [group[0] for group in groups]
+        for (payment, result), group in zip(self.confirm_each_payment(representatives), groups):
+            yield payment, result
+            for other_payment in group[1:]:
+                if self.shares_result(payment, result, other_payment):
+                    yield other_payment, result
+                else:
+                    yield other_payment, self.confirm_payment(other_payment)
+
+    async def aconfirm_payments(self, payments):
+        """
+        confirm_payments for an asyncio loop, the groups of payments are queried at the same time
+        :return: list of (payment, (status, value))
+        """
+        groups = self.group_payments(payments)
+        results = await self.aconfirm_each_payment([group[0] for group in groups])
+        confirmed = []
+        for result, group in zip(results, groups):
+            confirmed.append((group[0], result))
+            for other_payment in group[1:]:
+                if self.shares_result(group[0], result, other_payment):
+                    confirmed.append((other_payment, result))
+                else:
+                    confirmed.append((other_payment, await self.aconfirm_payment(other_payment)))
+        return confirmed
+
+    def group_payments(self, payments):
+        """
+        Group payments by address and transaction hash
+        :return: list of groups in order of their oldest payment
+        """
+        groups = OrderedDict()
         for payment in payments:
-            status, value = self.backend_obj.confirm_address_payment(
-                address=payment.address,
-                total_crypto_amount=payment.crypto_amount,
-                confirmation_number=self.confirmation_number,
-                accept_confirmed_bal_without_hash_mins=self.confirm_bal_without_hash_mins,
-                tx_hash=payment.tx_hash,
-            )
-            if status == self.backend_obj.UNCONFIRMED_ADDRESS_BALANCE:
-                payment.status = payment.PAYMENT_PROCESSING
-                payment.tx_hash = value
-            elif status == self.backend_obj.CONFIRMED_ADDRESS_BALANCE:
-                payment.status = payment.PAYMENT_PAID
-                payment.paid_crypto_amount = value
-            elif status == self.backend_obj.UNDERPAID_ADDRESS_BALANCE:
-                fiat_value = self.backend_obj.convert_to_fiat(
-                    value, payment.fiat_currency
+            groups.setdefault((payment.address, payment.tx_hash), []).append(payment)
+        return list(groups.values())
+
+    def shares_result(self, payment, result, other_payment):
+        """
+        Whether the confirm result of a payment holds for another payment of its group
+        """
+        if result is None:
+            return False
+        shared_statuses = (
+            self.backend_obj.UNCONFIRMED_ADDRESS_BALANCE,
+            self.backend_obj.NO_HASH_ADDRESS_BALANCE,
+        )
+        return result[0] in shared_statuses or other_payment.crypto_amount == payment.crypto_amount
+
+    def confirm_each_payment(self, payments):
+        """
+        Query the backend for each payment, at most POLL_CONCURRENCY queries run at the same time.
+        Backends with confirm_addresses_payment are queried with batches of POLL_BATCH_SIZE payments
+        :param payments: Payments to confirm
+        :return: (payment, (status, value)) in the same order as payments
+        """
+        if hasattr(self.backend_obj, "confirm_addresses_payment"):
+            batches = [
+                payments[start:start + self.poll_batch_size]
+                for start in range(0, len(payments), self.poll_batch_size)
+            ]
+            for batch, results in zip(batches, self.map_backend(self.confirm_payment_batch, batches)):
+                for payment, result in zip(batch, results):
+                    yield payment, result
+            return
+        for payment, result in zip(payments, self.map_backend(self.confirm_payment, payments)):
+            yield payment, result
+
+    async def aconfirm_each_payment(self, payments):
+        """
+        confirm_each_payment for an asyncio loop, every payment or batch is queried at the same time
+        :return: (status, value) in the same order as payments
+        """
+        if hasattr(self.backend_obj, "confirm_addresses_payment") and not hasattr(
+            self.backend_obj, "aconfirm_address_payment"
+        ):
+            batches = [
+                payments[start:start + self.poll_batch_size]
+                for start in range(0, len(payments), self.poll_batch_size)
+            ]
+            results = await asyncio.gather(*[self.aconfirm_payment_batch(batch) for batch in batches])
+            return [result for batch_results in results for result in batch_results]
+        return await asyncio.gather(*[self.aconfirm_payment(payment) for payment in payments])
+
+    async def aconfirm_payment(self, payment):
+        async with self.async_poll_semaphore:
+            if not hasattr(self.backend_obj, "aconfirm_address_payment"):
+                return await sync_to_async(self.confirm_payment, thread_sensitive=False)(payment)
+            self.count("backend_calls")
+            try:
+                with timed("confirm_address_payment", self.crypto):
+                    return await self.backend_obj.aconfirm_address_payment(**self.get_confirm_kwargs(payment))
+            except Exception:
+                self.count("errors")
+                return None
+
+    async def aconfirm_payment_batch(self, payments):
+        async with self.async_poll_semaphore:
+            return await sync_to_async(self.confirm_payment_batch, thread_sensitive=False)(payments)
+
+    def map_backend(self, func, items):
+        if self.poll_concurrency <= 1:
+            for item in items:
+                yield func(item)
+            return
+        with ThreadPoolExecutor(max_workers=self.poll_concurrency) as executor:
+            for result in executor.map(func, items):
+                yield result
+
+    def get_confirm_kwargs(self, payment):
+        return dict(
+            address=payment.address,
+            total_crypto_amount=payment.crypto_amount,
+            confirmation_number=self.confirmation_number,
+            accept_confirmed_bal_without_hash_mins=self.confirm_bal_without_hash_mins,
+            tx_hash=payment.tx_hash,
+        )
+
+    def confirm_payment(self, payment):
+        """
+        Query the backend for a payment
+        :return: (status, value) or None when the backend failed, counted in the run errors
+        """
+        self.count("backend_calls")
+        try:
+            with timed("confirm_address_payment", self.crypto):
+                return self.backend_obj.confirm_address_payment(**self.get_confirm_kwargs(payment))
+        except Exception:
+            self.count("errors")
+            return None
+
+    def confirm_payment_batch(self, payments):
+        """
+        Query the backend for many payments in one call with confirm_addresses_payment. It gets a list of
+        confirm_address_payment keyword arguments and returns a (status, value) or an exception for each of them,
+        payments that failed in the batch or a batch that failed as a whole are queried one by one
+        :param payments: Payments to confirm
+        :return: (status, value) in the same order as payments
+        """
+        self.count("backend_calls")
+        try:
+            with timed("confirm_addresses_payment", self.crypto):
+                results = self.backend_obj.confirm_addresses_payment(
+                    [self.get_confirm_kwargs(payment) for payment in payments]
                 )
-                if (
-                    self.create_new_underpayment
-                    and fiat_value > self.ignore_underpayment_amount
-                ):
-                    payment.child_payment = create_child_payment(payment, fiat_value)
-                payment.status = payment.PAYMENT_PAID
-                payment.paid_crypto_amount = value
-            elif status == self.backend_obj.NO_HASH_ADDRESS_BALANCE:
-                payment.status = payment.PAYMENT_WAIT
-                payment.save() #no payment found yet
-            else:
-                # unknown error occured cancel payment
-                payment.status = payment.PAYMENT_CANCELLED
-            payment.save()
+        except Exception:
+            self.count("errors")
+            results = []
+        results = list(results) + [None] * (len(payments) - len(results))
+        self.count("errors", sum(1 for result in results if isinstance(result, Exception)))
+        return [
+            self.confirm_payment(payment) if result is None or isinstance(result, Exception) else result
+            for payment, result in zip(payments, results)
+        ]
+
+    def update_payment(self, payment, status, value, notified=False):
+        """
+        Save the new state of a payment from the status and value returned by the backend
+        :param payment: Payment that was confirmed
+        :param status: Status returned by confirm_address_payment
+        :param value: Value returned by confirm_address_payment
+        :param notified: The payment was checked because of a notification
+        :return:
+        """
+        old_status = payment.status
+        if status == self.backend_obj.UNCONFIRMED_ADDRESS_BALANCE:
+            payment.status = payment.PAYMENT_PROCESSING
+            payment.tx_hash = value
+        elif status == self.backend_obj.CONFIRMED_ADDRESS_BALANCE:
+            payment.status = payment.PAYMENT_PAID
+            payment.paid_crypto_amount = value
+        elif status == self.backend_obj.UNDERPAID_ADDRESS_BALANCE:
+            fiat_value = self.exchange_rates.convert_to_fiat(
+                value, payment.fiat_currency
+            )
+            if (
+                self.create_new_underpayment
+                and fiat_value > self.ignore_underpayment_amount
+            ):
+                payment.child_payment = create_child_payment(payment, fiat_value)
+            payment.status = payment.PAYMENT_PAID
+            payment.paid_crypto_amount = value
+        elif status == self.backend_obj.NO_HASH_ADDRESS_BALANCE:
+            payment.status = payment.PAYMENT_WAIT #no payment found yet
+        else:
+            # unknown error occured cancel payment
+            payment.status = payment.PAYMENT_CANCELLED
+        payment.next_check_at = self.get_next_check_at(payment, notified=notified)
+        payment.save()
+        if payment.status != old_status:
+            self.count("rows_changed")
+            payment_status_changed.send(
+                sender=CryptoCurrencyPayment,
+                crypto=self.crypto,
+                old_status=old_status,
+                new_status=payment.status,
+                count=1,
+            )
+
+    def get_next_check_at(self, payment, now=None, notified=False):
+        """
+        When a payment should be checked again. Processing payments are checked again after BLOCK_INTERVAL_SECONDS,
+        new and waiting payments after POLL_MIN_INTERVAL_SECONDS doubled for every POLL_BACKOFF_AFTER_SECONDS of
+        their age up to POLL_MAX_INTERVAL_SECONDS, or at most POLL_MAX_BACKOFF_DOUBLINGS times. Notified new and
+        waiting payments are left to further notifications and only checked again after NOTIFY_POLL_DELAY_SECONDS,
+        notified processing payments still need their confirmations and keep BLOCK_INTERVAL_SECONDS.
+        Closed payments are not checked again
+        :param payment: Payment with its new status
+        :param now: Time the payment was checked
+        :param notified: The payment was checked because of a notification
+        :return: datetime or None
+        """
+        now = now or timezone.now()
+        if payment.status not in payment.OPEN_STATUSES:
+            return None
+        if payment.status == payment.PAYMENT_PROCESSING:
+            return now + timedelta(seconds=self.block_interval_seconds)
+        if notified:
+            return now + timedelta(seconds=self.notify_poll_delay_seconds)
+        delay = self.poll_min_interval_seconds
+        if self.poll_backoff_after_seconds:
+            age = (now - payment.created_at).total_seconds()
+            delay = delay * 2 ** min(int(age // self.poll_backoff_after_seconds), POLL_MAX_BACKOFF_DOUBLINGS)
+        if self.poll_max_interval_seconds:
+            delay = min(delay, self.poll_max_interval_seconds)
+        return now + timedelta(seconds=delay)
 
+    @timed_method("cancel_unpaid_payment")
     def cancel_unpaid_payment(self):
         """
         Any unpaid payment still in new payment status less than a particular time can be cancelled
-        . To reduce resources when checking for new payment status
-        :return:
+        . To reduce resources when checking for new payment status. Payments are cancelled with one update per status
+        :return: Number of cancelled payments
         """
         yesterday_time = timezone.now() - timedelta(hours=self.unpaid_payment_hrs)
-        payments = CryptoCurrencyPayment.objects.filter(
-            status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT],
-            created_at__lte=yesterday_time,
+        return self.cancel_payments(
+            CryptoCurrencyPayment.objects.filter(crypto=self.crypto, created_at__lte=yesterday_time)
         )
-        for payment in payments:
-            payment.status = payment.PAYMENT_CANCELLED
-            payment.save()
 
+    def cancel_payments(self, payments):
+        """
+        Cancel the new and waiting payments of a queryset with a single update, the payments of each status are
+        counted beforehand for payment_status_changed
+        :param payments: Queryset of payments of this crypto
+        :return: Number of cancelled payments
+        """
+        open_payments = payments.filter(
+            status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT]
+        )
+        status_counts = open_payments.order_by().values_list("status").annotate(count=Count("pk"))
+        status_counts = OrderedDict(sorted(status_counts))
+        cancelled = open_payments.update(status=CryptoCurrencyPayment.PAYMENT_CANCELLED, updated_at=timezone.now())
+        self.count("rows_scanned", cancelled)
+        self.count("rows_changed", cancelled)
+        if cancelled:
+            for status, count in status_counts.items():
+                payment_status_changed.send(
+                    sender=CryptoCurrencyPayment,
+                    crypto=self.crypto,
+                    old_status=status,
+                    new_status=CryptoCurrencyPayment.PAYMENT_CANCELLED,
+                    count=count,
+                )
+        return cancelled
+
+    @timed_method("refresh_payment_prices")
     def refresh_new_crypto_payment_amount(self):
         """
         Due to volatility of crypto prices, Payment prices can be refreshed regularly especially for payment in
-        new status
-        :return:
+        new status. Payments are read and saved with bulk updates CHUNK_SIZE at a time
+        :return: Number of refreshed payments
         """
         leastupdate_time = timezone.now() - timedelta(
             minutes=self.refresh_prices_every_mins
         )
-        payments = CryptoCurrencyPayment.objects.filter(
-            status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT], updated_at__lte=leastupdate_time
+        return self.refresh_payments_amount(
+            CryptoCurrencyPayment.objects.filter(crypto=self.crypto, updated_at__lte=leastupdate_time)
         )
-        for payment in payments:
-            amount = self.backend_obj.convert_from_fiat(
-                payment.fiat_amount, payment.fiat_currency
-            )
-            payment.crypto_amount = amount
-            payment.save()
+
+    def refresh_payments_amount(self, payments):
+        """
+        Convert the fiat amount of the new and waiting payments of a queryset again with the current rate
+        :param payments: Queryset of payments of this crypto
+        :return: Number of refreshed payments
+        """
+        now = timezone.now()
+        payments = (
+            payments.filter(status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT])
+            .select_related(None)
+            .only("pk", "created_at", "fiat_amount", "fiat_currency")
+        )
+        self.exchange_rates = ExchangeRates(self.crypto, self.backend_obj)
+        refreshed = 0
+        for chunk in payments.iter_chunks(self.CHUNK_SIZE):
+            for payment in chunk:
+                payment.crypto_amount = self.exchange_rates.convert_from_fiat(
+                    payment.fiat_amount, payment.fiat_currency
+                )
+                payment.updated_at = now
+            refreshed += self.save_refreshed_payments(chunk)
+        self.count("rows_scanned", refreshed)
+        self.count("rows_changed", refreshed)
+        return refreshed
+
+    def save_refreshed_payments(self, payments):
+        CryptoCurrencyPayment.objects.bulk_update(payments, ["crypto_amount", "updated_at"])
+        return len(payments)
+
+    @timed_method("refill_address_pool")
+    def refill_address_pool(self):
+        """
+        Fill the address pool back to ADDRESS_POOL_SIZE once its free addresses drop below ADDRESS_POOL_LOW_WATER
+        :return: Number of addresses added
+        """
+        pool_size = get_backend_config(self.crypto, "ADDRESS_POOL_SIZE")
+        if not pool_size:
+            return 0
+        low_water = get_backend_config(self.crypto, "ADDRESS_POOL_LOW_WATER") or pool_size
+        free_count = CryptoAddressPool.get_free_count(
+            self.crypto,
+            get_backend_config(self.crypto, "ADDRESS_TYPE"),
+            get_backend_config(self.crypto, "DERIVATION_PATH"),
+        )
+        if free_count >= low_water:
+            return 0
+        added = fill_address_pool(self.crypto, backend=self.backend_obj, size=pool_size)
+        self.count("rows_changed", added)
+        return added
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from django import template
+
+from cryptocurrency_payment import qr
+from cryptocurrency_payment.app_settings import get_backend_config
+
+register = template.Library()
+
+
+@register.simple_tag
+def payment_uri(payment):
+    """
+    BIP21 URI of a payment with its address, amount, title and description
+    """
+    return qr.get_payment_uri(
+        get_backend_config(payment.crypto, key="URI_SCHEME"),
+        payment.address,
+        payment.crypto_amount,
+        payment.payment_title,
+        payment.payment_description,
+    )
+
+
+@register.simple_tag
+def payment_qr_url(payment):
+    """
+    URL of the QR code of a payment, see qr.get_qr_url
+    """
+    return qr.get_qr_url(payment.pk, payment_uri(payment))
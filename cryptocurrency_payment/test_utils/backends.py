@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import time
+from decimal import Decimal
+
+
+class FakeBackend:
+    """
+    Backend that answers from memory instead of a blockchain. Results are set per address in
+    address_results and every confirmation call is recorded in calls
+    """
+
+    UNCONFIRMED_ADDRESS_BALANCE = 0
+    CONFIRMED_ADDRESS_BALANCE = 1
+    UNDERPAID_ADDRESS_BALANCE = -1
+    NO_HASH_ADDRESS_BALANCE = -2
+
+    address_results = {}
+    calls = []
+    rate = Decimal("20000")
+
+    def __init__(self, public_key, symbol="BTC"):
+        self.public_key = public_key
+        self.symbol = symbol
+        self.wallet = None
+
+    @classmethod
+    def reset(cls):
+        cls.address_results = {}
+        cls.calls = []
+
+    def generate_new_address(self, index):
+        self.wallet.clean_derivation()
+        self.wallet.from_path("m/0/{}".format(index))
+        return self.wallet.p2pkh_address()
+
+    def convert_from_fiat(self, amount, currency="USD"):
+        return round(Decimal(str(amount)) / self.rate, 8)
+
+    def convert_to_fiat(self, amount, currency):
+        return round(Decimal(str(amount)) * self.rate, 2)
+
+    def get_address_result(self, address):
+        result = self.address_results.get(address, (self.NO_HASH_ADDRESS_BALANCE, None))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def confirm_address_payment(
+        self,
+        address,
+        total_crypto_amount,
+        confirmation_number=1,
+        accept_confirmed_bal_without_hash_mins=20,
+        tx_hash=None,
+    ):
+        self.calls.append([address])
+        return self.get_address_result(address)
+
+
+class FakeBatchBackend(FakeBackend):
+    """
+    FakeBackend that can confirm many addresses in one call. Addresses in batch_failures
+    fail inside the batch but still answer when confirmed on their own
+    """
+
+    batch_failures = set()
+
+    @classmethod
+    def reset(cls):
+        super(FakeBatchBackend, cls).reset()
+        cls.batch_failures = set()
+
+    def confirm_addresses_payment(self, batch):
+        self.calls.append([payment["address"] for payment in batch])
+        results = []
+        for payment in batch:
+            if payment["address"] in self.batch_failures:
+                results.append(Exception("{} failed".format(payment["address"])))
+                continue
+            try:
+                results.append(self.get_address_result(payment["address"]))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class FakeAsyncBackend(FakeBackend):
+    """
+    FakeBackend with the coroutine aconfirm_address_payment. Calls wait latency seconds on the loop and
+    the most calls waiting at the same time is recorded in max_running
+    """
+
+    latency = 0
+    running = 0
+    max_running = 0
+
+    @classmethod
+    def reset(cls):
+        super(FakeAsyncBackend, cls).reset()
+        cls.latency = 0
+        cls.running = 0
+        cls.max_running = 0
+
+    async def aconfirm_address_payment(
+        self,
+        address,
+        total_crypto_amount,
+        confirmation_number=1,
+        accept_confirmed_bal_without_hash_mins=20,
+        tx_hash=None,
+    ):
+        self.calls.append([address])
+        FakeAsyncBackend.running += 1
+        FakeAsyncBackend.max_running = max(FakeAsyncBackend.max_running, FakeAsyncBackend.running)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            FakeAsyncBackend.running -= 1
+        return self.get_address_result(address)
+
+
+class SimulatedBackendError(Exception):
+    pass
+
+
+class SimulatedBackend(FakeBackend):
+    """
+    FakeBackend that makes up a result for every address instead of reading address_results. Each address
+    gets one of outcomes picked by their weight, confirmation calls take latency seconds and fail with
+    error_rate probability. Picks only depend on seed and the address so runs can be repeated
+    """
+
+    latency = 0
+    error_rate = 0
+    seed = 0
+    outcomes = {
+        FakeBackend.NO_HASH_ADDRESS_BALANCE: 6,
+        FakeBackend.UNCONFIRMED_ADDRESS_BALANCE: 2,
+        FakeBackend.CONFIRMED_ADDRESS_BALANCE: 1,
+        FakeBackend.UNDERPAID_ADDRESS_BALANCE: 1,
+    }
+
+    @classmethod
+    def configure(cls, latency=0, error_rate=0, seed=0, outcomes=None):
+        cls.reset()
+        cls.latency = latency
+        cls.error_rate = error_rate
+        cls.seed = seed
+        cls.outcomes = outcomes or SimulatedBackend.outcomes
+
+    def get_random(self, address, call):
+        return random.Random("{}:{}:{}".format(self.seed, address, call))
+
+    def get_address_result(self, address, total_crypto_amount=None):
+        if address in self.address_results:
+            return super(SimulatedBackend, self).get_address_result(address)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.get_random(address, len(self.calls)).random() < self.error_rate:
+            raise SimulatedBackendError("{} failed".format(address))
+        statuses = sorted(self.outcomes)
+        status = self.get_random(address, "outcome").choices(statuses, [self.outcomes[s] for s in statuses])[0]
+        if status == self.UNCONFIRMED_ADDRESS_BALANCE:
+            return status, "tx-{}".format(address)
+        if status == self.CONFIRMED_ADDRESS_BALANCE:
+            return status, total_crypto_amount
+        if status == self.UNDERPAID_ADDRESS_BALANCE:
+            return status, total_crypto_amount / 2
+        return status, None
+
+    def confirm_address_payment(
+        self,
+        address,
+        total_crypto_amount,
+        confirmation_number=1,
+        accept_confirmed_bal_without_hash_mins=20,
+        tx_hash=None,
+    ):
+        self.calls.append([address])
+        return self.get_address_result(address, total_crypto_amount)
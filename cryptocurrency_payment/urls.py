@@ -11,5 +11,30 @@ urlpatterns = [
         view=views.CryptoPaymentDetailView.as_view(),
         name='crypto_payment_detail',
     ),
+    path(
+        "payment/<uuid:pk>/status.json",
+        view=views.CryptoPaymentStatusView.as_view(),
+        name='crypto_payment_status',
+    ),
+    path(
+        "payment/<uuid:pk>/qr.svg",
+        view=views.CryptoPaymentQRView.as_view(),
+        name='crypto_payment_qr',
+    ),
+    path(
+        "payment/<uuid:pk>/events/",
+        view=views.CryptoPaymentEventsView.as_view(),
+        name='crypto_payment_events',
+    ),
+    path(
+        "notify/<str:crypto>/",
+        view=views.CryptoPaymentNotifyView.as_view(),
+        name='crypto_payment_notify',
+    ),
+    path(
+        "metrics/",
+        view=views.CryptoPaymentMetricsView.as_view(),
+        name='crypto_payment_metrics',
+    ),
 
 ]
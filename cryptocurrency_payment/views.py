@@ -1,14 +1,73 @@
 # -*- coding: utf-8 -*-
-from django.views.generic import DetailView
-from django.http import Http404
+import hashlib
+import hmac
+import json
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import get_language
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import DetailView, View
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+)
+try:
+    from django.core.handlers.asgi import ASGIRequest
+except ImportError:  # pragma: no cover
+    ASGIRequest = None
+from cryptocurrency_payment import qr
+from cryptocurrency_payment.events import get_payment_status, get_payment_status_data, PaymentEventStream
+from cryptocurrency_payment.metrics import get_metrics_sink
 from cryptocurrency_payment.models import CryptoCurrencyPayment
-from cryptocurrency_payment.app_settings import get_backend_config
+from cryptocurrency_payment.app_settings import get_active_backends, get_backend_config
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+RENDER_CACHE_KEY = 'cryptocurrency_payment:render:{}:{}:{}:{}:{}:{}'
 
 
 class CryptoPaymentDetailView(DetailView):
-    queryset = CryptoCurrencyPayment.objects.all()
+    """
+    Payment page. The payment is read with its user, child and parent payments in one query and the rendered page
+    is kept in CRYPTOCURRENCY_PAYMENT_RENDER_CACHE under the payment id, updated_at, language and time zone,
+    so repeat views of an unchanged payment are not rendered again. Pages only subscribe to the events stream
+    when events_enabled
+    """
+    queryset = CryptoCurrencyPayment.objects.select_related('user', 'child_payment', 'parent_payment')
     context_object_name = 'payment'
     template_name = 'cryptocurrency_payment/payment_detail.html'
+    render_cache_timeout = 60 * 60
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        cache_alias = getattr(settings, 'CRYPTOCURRENCY_PAYMENT_RENDER_CACHE', 'default')
+        if not cache_alias:
+            return self.render_to_response(self.get_context_data(object=self.object))
+        cache = caches[cache_alias]
+        cache_key = RENDER_CACHE_KEY.format(
+            self.template_name,
+            self.object.pk,
+            self.object.updated_at.timestamp(),
+            get_language(),
+            timezone.get_current_timezone_name(),
+            events_enabled(self.request),
+        )
+        content = cache.get(cache_key)
+        if content is None:
+            response = self.render_to_response(self.get_context_data(object=self.object))
+            response.render()
+            cache.set(cache_key, response.content, self.render_cache_timeout)
+            return response
+        return HttpResponse(content)
+
+    def get_context_data(self, **kwargs):
+        context = super(CryptoPaymentDetailView, self).get_context_data(**kwargs)
+        context['events_enabled'] = events_enabled(self.request)
+        return context
 
     def get_object(self, *args ):
 
@@ -19,3 +78,165 @@ class CryptoPaymentDetailView(DetailView):
         elif not self.request.user.is_superuser and  obj.user and self.request.user != obj.user:
             raise Http404
         return obj
+
+
+def is_asgi_request(request):
+    return ASGIRequest is not None and isinstance(request, ASGIRequest)
+
+
+def events_enabled(request):
+    """
+    Whether payment pages subscribe to the events stream. Under WSGI every open stream holds a worker thread,
+    so pages poll status.json unless CRYPTOCURRENCY_PAYMENT_WSGI_EVENTS is set. Under ASGI before Django 4.2
+    the stream is one poll per reconnect, heavier than polling status.json, so pages poll there too
+    """
+    if is_asgi_request(request):
+        return django.VERSION >= (4, 2)
+    return getattr(settings, 'CRYPTOCURRENCY_PAYMENT_WSGI_EVENTS', False)
+
+
+def check_payment_access(request, crypto, user_id):
+    """
+    Raise Http404 when the request may not see a payment, the same rules as CryptoPaymentDetailView
+    """
+    allow_anon_payment = get_backend_config(crypto, key='ALLOW_ANONYMOUS_PAYMENT')
+    if allow_anon_payment is not True and request.user.is_authenticated is not True:
+        raise Http404
+    elif not request.user.is_superuser and user_id and request.user.pk != user_id:
+        raise Http404
+
+
+class CryptoPaymentStatusView(View):
+    """
+    Status of a payment for checkout pages to poll. Only the columns needed are read and unchanged payments
+    get a 304 from their ETag or Last-Modified, both taken from updated_at
+    """
+    http_method_names = ['get', 'head']
+
+    def get(self, request, pk):
+        payment = get_payment_status(pk)
+        if payment is None:
+            raise Http404
+        check_payment_access(request, payment['crypto'], payment['user_id'])
+        etag = '"{}"'.format(payment['updated_at'].timestamp())
+        last_modified = int(payment['updated_at'].timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = JsonResponse(get_payment_status_data(payment))
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class CryptoPaymentQRView(View):
+    """
+    QR code of the BIP21 URI of a payment as SVG. QR codes are cached by the digest of their content, which changes
+    only when the amount or address of the payment does. Requests carrying the current digest as v can be cached
+    by browsers for a year
+    """
+    http_method_names = ['get', 'head']
+
+    def get(self, request, pk):
+        payment = CryptoCurrencyPayment.objects.filter(pk=pk).values(
+            'crypto', 'user_id', 'address', 'crypto_amount', 'payment_title', 'payment_description'
+        ).first()
+        if payment is None:
+            raise Http404
+        check_payment_access(request, payment['crypto'], payment['user_id'])
+        uri = qr.get_payment_uri(
+            get_backend_config(payment['crypto'], key='URI_SCHEME'),
+            payment['address'],
+            payment['crypto_amount'],
+            payment['payment_title'],
+            payment['payment_description'],
+        )
+        digest = qr.get_qr_digest(uri)
+        etag = '"{}"'.format(digest)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = caches[getattr(settings, 'CRYPTOCURRENCY_PAYMENT_RENDER_CACHE', None) or 'default']
+            response = HttpResponse(qr.get_qr_svg(uri, cache), content_type='image/svg+xml')
+        response['ETag'] = etag
+        if request.GET.get('v') == digest:
+            patch_cache_control(response, private=True, max_age=365 * 24 * 60 * 60, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class CryptoPaymentEventsView(View):
+    """
+    Server-Sent Events stream of a payment status, see PaymentEventStream. Under ASGI the stream is sent
+    asynchronously on Django 4.2 and later, older versions send one poll per response so the event loop is never
+    blocked and browsers reconnect for the next one. Under WSGI the stream holds a worker thread while open
+    """
+    http_method_names = ['get']
+    poll_interval = 1
+    refresh_interval = 30
+    max_duration = 300
+
+    def get(self, request, pk):
+        payment = CryptoCurrencyPayment.objects.filter(pk=pk).values('crypto', 'user_id').first()
+        if payment is None:
+            raise Http404
+        check_payment_access(request, payment['crypto'], payment['user_id'])
+        stream = PaymentEventStream(
+            pk,
+            poll_interval=self.poll_interval,
+            refresh_interval=self.refresh_interval,
+            max_duration=self.max_duration,
+        )
+        if not is_asgi_request(request):
+            content = iter(stream)
+        elif django.VERSION < (4, 2):
+            content = stream.chunk()
+        else:
+            content = stream
+        response = StreamingHttpResponse(content, content_type='text/event-stream')
+        response['X-Accel-Buffering'] = 'no'
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CryptoPaymentNotifyView(View):
+    """
+    Receive addresses a node or explorer saw a transaction for, as {"addresses": [...]}. The body is signed
+    with the crypto NOTIFY_SECRET, its hex HMAC-SHA256 is sent in the X-Signature header.
+    Open payments of these addresses are checked right away instead of waiting for update_payment_status
+    """
+    http_method_names = ['post']
+
+    def post(self, request, crypto):
+        crypto = crypto.upper()
+        if crypto not in get_active_backends():
+            raise Http404
+        secret = get_backend_config(crypto, key='NOTIFY_SECRET')
+        if not secret:
+            raise Http404
+        signature = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, request.META.get('HTTP_X_SIGNATURE', '')):
+            return HttpResponseForbidden()
+        try:
+            addresses = json.loads(request.body.decode())['addresses']
+        except (ValueError, TypeError, KeyError):
+            return HttpResponseBadRequest()
+        if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+            return HttpResponseBadRequest()
+        checked = CryptoCurrencyPaymentTask(crypto).update_notified_payment_status(addresses)
+        return JsonResponse({'checked': checked})
+
+
+class CryptoPaymentMetricsView(View):
+    """
+    Metrics of the configured sink in the Prometheus text format. Only served with
+    CRYPTOCURRENCY_PAYMENT_METRICS_ENDPOINT set and a sink that can render them
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        sink = get_metrics_sink()
+        if not getattr(settings, 'CRYPTOCURRENCY_PAYMENT_METRICS_ENDPOINT', False) or not hasattr(sink, 'render'):
+            raise Http404
+        return HttpResponse(sink.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -56,22 +56,26 @@ setup(
         'cryptocurrency_payment',
     ],
     include_package_data=True,
-    install_requires=[],
+    install_requires=['Django>=3.0'],
+    python_requires='>=3.6',
+    extras_require={
+        'qr': ['segno'],
+    },
     license="MIT",
     zip_safe=False,
     keywords='django-cryptocurrency-payment',
     classifiers=[
         'Development Status :: 3 - Alpha',
-        'Framework :: Django :: 2.1',
+        'Framework :: Django :: 3.0',
+        'Framework :: Django :: 4.0',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
     ],
 )
@@ -130,6 +130,8 @@ CRYPTOCURRENCY_PAYMENT = {
             "IGNORE_CONFIRMED_BALANCE_WITHOUT_SAVED_HASH_MINS": 20,
             "BALANCE_CONFIRMATION_NUM": 1,
             "ALLOW_ANONYMOUS_PAYMENT": True,
+            "DERIVATION_PATH": "m/0",
+            "ADDRESS_TYPE": "p2pkh",
         },
     "BITCOINTEST": {
         "CODE": "btc",
@@ -145,5 +147,7 @@ CRYPTOCURRENCY_PAYMENT = {
         "IGNORE_CONFIRMED_BALANCE_WITHOUT_SAVED_HASH_MINS": 20,
         "BALANCE_CONFIRMATION_NUM": 1,
         "ALLOW_ANONYMOUS_PAYMENT": False,
+        "DERIVATION_PATH": "m/0",
+        "ADDRESS_TYPE": "p2pkh",
     },
     }
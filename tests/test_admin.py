@@ -0,0 +1,121 @@
+import sys
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from cryptocurrency_payment.admin import EstimatedCountPaginator
+from cryptocurrency_payment.app_settings import get_active_backends
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment, PaymentTaskRun
+
+from merchant_wallet.backends.btc import BitcoinBackend
+
+
+class TestPaymentTaskRunAdmin(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+    def test_changelist_shows_run_aggregates(self):
+        PaymentTaskRun.start("update_payment_status", "BITCOIN").finish({"rows_scanned": 10, "backend_calls": 4})
+        PaymentTaskRun.start("update_payment_status", "BITCOIN").finish({"rows_scanned": 5, "errors": 1}, failed=True)
+        response = self.client.get(reverse("admin:cryptocurrency_payment_paymenttaskrun_changelist"))
+        self.assertEqual(response.status_code, 200)
+        summary = list(response.context["run_summary"])
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(
+            (summary[0]["runs"], summary[0]["failed"], summary[0]["rows_scanned"], summary[0]["errors"]), (2, 1, 15, 1)
+        )
+
+
+class TestCryptoCurrencyPaymentAdmin(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user_obj = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.user_obj)
+        self.url = reverse("admin:cryptocurrency_payment_cryptocurrencypayment_changelist")
+        self.payments = [create_new_payment("BITCOIN", 10, "USD", user=self.user_obj) for _ in range(3)]
+
+    def run_action(self, action, payments):
+        return self.client.post(
+            self.url, {"action": action, "_selected_action": [payment.pk for payment in payments]}, follow=True
+        )
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        create_new_payment("BITCOIN", 10, "USD", user=self.user_obj)
+        with self.assertNumQueries(len(context)):
+            self.client.get(self.url)
+
+    def test_crypto_filter_lists_active_backends(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {"crypto": "BITCOIN"})
+        self.assertFalse([query for query in context.captured_queries if "DISTINCT" in query["sql"]])
+        self.assertEqual(len(response.context["cl"].result_list), 3)
+        crypto_filter = [spec for spec in response.context["cl"].filter_specs if spec.title == "crypto"][0]
+        self.assertEqual([value for value, title in crypto_filter.lookup_choices], get_active_backends())
+
+    def test_search_matches_address_and_tx_hash(self):
+        CryptoCurrencyPayment.objects.filter(pk=self.payments[1].pk).update(tx_hash="hash")
+        response = self.client.get(self.url, {"q": self.payments[0].address})
+        self.assertEqual(list(response.context["cl"].result_list), [self.payments[0]])
+        response = self.client.get(self.url, {"q": "hash"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.payments[1]])
+        response = self.client.get(self.url, {"q": self.payments[0].address[:10]})
+        self.assertEqual(list(response.context["cl"].result_list), [])
+
+    def test_estimated_count_used_for_large_unfiltered_tables(self):
+        queryset = CryptoCurrencyPayment.objects.order_by("-created_at")
+        with mock.patch("cryptocurrency_payment.admin.get_estimated_count", return_value=10 ** 6):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 10 ** 6)
+        with mock.patch("cryptocurrency_payment.admin.get_estimated_count", return_value=100):
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 3)
+        self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 3)
+
+    def test_cancel_action_cancels_open_payments(self):
+        CryptoCurrencyPayment.objects.filter(pk=self.payments[1].pk).update(
+            status=CryptoCurrencyPayment.PAYMENT_PROCESSING
+        )
+        with mock.patch.object(CryptoCurrencyPayment, "save") as save:
+            response = self.run_action("cancel_payments", self.payments[:2])
+        save.assert_not_called()
+        self.assertContains(response, "1 payments cancelled")
+        statuses = dict(CryptoCurrencyPayment.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[self.payments[0].pk], CryptoCurrencyPayment.PAYMENT_CANCELLED)
+        self.assertEqual(statuses[self.payments[1].pk], CryptoCurrencyPayment.PAYMENT_PROCESSING)
+        self.assertEqual(statuses[self.payments[2].pk], CryptoCurrencyPayment.PAYMENT_NEW)
+
+    def test_refresh_price_action(self):
+        CryptoCurrencyPayment.objects.filter(pk__in=[payment.pk for payment in self.payments]).update(
+            crypto_amount=1
+        )
+        response = self.run_action("refresh_payment_prices", self.payments[:2])
+        self.assertContains(response, "2 payment prices refreshed")
+        amounts = dict(CryptoCurrencyPayment.objects.values_list("pk", "crypto_amount"))
+        self.assertNotEqual(amounts[self.payments[0].pk], 1)
+        self.assertEqual(amounts[self.payments[2].pk], 1)
+
+    def test_recheck_action_checks_selected_payments(self):
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+        ) as confirm_address_payment:
+            response = self.run_action("recheck_payments", self.payments[:2])
+        self.assertContains(response, "2 payments checked")
+        self.assertEqual(
+            sorted(call[1]["address"] for call in confirm_address_payment.call_args_list),
+            sorted(payment.address for payment in self.payments[:2]),
+        )
+        statuses = dict(CryptoCurrencyPayment.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[self.payments[0].pk], CryptoCurrencyPayment.PAYMENT_PROCESSING)
+        self.assertEqual(statuses[self.payments[2].pk], CryptoCurrencyPayment.PAYMENT_NEW)
@@ -0,0 +1,49 @@
+import copy
+import sys
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from cryptocurrency_payment import app_settings
+from cryptocurrency_payment.app_settings import clear_backend_cache, get_backend_obj
+
+
+class TestBackendRegistry(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        clear_backend_cache()
+
+    def test_backend_built_once_per_crypto(self):
+        with mock.patch.object(
+            app_settings, "build_backend_obj", wraps=app_settings.build_backend_obj
+        ) as build:
+            get_backend_obj(self.crypto)
+            get_backend_obj(self.crypto.lower())
+            get_backend_obj("BITCOINTEST")
+        self.assertEqual(build.call_count, 2)
+
+    def test_wallet_state_does_not_leak_between_callers(self):
+        backend = get_backend_obj(self.crypto)
+        backend_two = get_backend_obj(self.crypto)
+        self.assertIsNot(backend, backend_two)
+        self.assertIsNot(backend.wallet, backend_two.wallet)
+        backend.wallet.from_path("m/0/5")
+        self.assertNotEqual(backend.wallet.path(), backend_two.wallet.path())
+
+    def test_backend_rebuilt_when_settings_change(self):
+        crypto_settings = copy.deepcopy(settings.CRYPTOCURRENCY_PAYMENT)
+        crypto_settings[self.crypto]["CODE"] = "ltc"
+        get_backend_obj(self.crypto)
+        with mock.patch.object(
+            app_settings, "build_backend_obj", wraps=app_settings.build_backend_obj
+        ) as build:
+            with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings):
+                get_backend_obj(self.crypto)
+            get_backend_obj(self.crypto)
+        self.assertEqual(build.call_count, 2)
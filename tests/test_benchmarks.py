@@ -0,0 +1,82 @@
+import io
+
+from django.test import TestCase, override_settings
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+from cryptocurrency_payment.test_utils.backends import SimulatedBackend, SimulatedBackendError
+
+from benchmarks.run import print_results, run_benchmarks
+
+from tests.test_models import crypto_settings
+
+
+def simulated_settings(crypto):
+    return crypto_settings(crypto, BACKEND="cryptocurrency_payment.test_utils.backends.SimulatedBackend")
+
+
+class TestSimulatedBackend(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        SimulatedBackend.configure(seed=1)
+        self.addCleanup(SimulatedBackend.configure)
+
+    def test_outcomes_repeat_for_same_seed(self):
+        backend = SimulatedBackend("xpub")
+        addresses = ["address-{}".format(index) for index in range(50)]
+        results = [backend.confirm_address_payment(address, 1) for address in addresses]
+        SimulatedBackend.configure(seed=1)
+        self.assertEqual(results, [backend.confirm_address_payment(address, 1) for address in addresses])
+        self.assertEqual(len(set(status for status, _ in results)), 4)
+        SimulatedBackend.configure(seed=2)
+        self.assertNotEqual(results, [backend.confirm_address_payment(address, 1) for address in addresses])
+
+    def test_single_outcome_and_errors(self):
+        SimulatedBackend.configure(outcomes={SimulatedBackend.CONFIRMED_ADDRESS_BALANCE: 1})
+        backend = SimulatedBackend("xpub")
+        self.assertEqual(
+            backend.confirm_address_payment("address", 2), (SimulatedBackend.CONFIRMED_ADDRESS_BALANCE, 2)
+        )
+        SimulatedBackend.configure(error_rate=1)
+        with self.assertRaises(SimulatedBackendError):
+            backend.confirm_address_payment("address", 2)
+
+    def test_task_updates_payments_from_simulated_backend(self):
+        SimulatedBackend.configure(outcomes={SimulatedBackend.UNCONFIRMED_ADDRESS_BALANCE: 1})
+        with override_settings(CRYPTOCURRENCY_PAYMENT=simulated_settings(self.crypto)):
+            payment = create_new_payment(self.crypto, 10, "USD")
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+        self.assertEqual(payment.tx_hash, "tx-{}".format(payment.address))
+
+
+class TestBenchmarks(TestCase):
+    def test_benchmarks_report_each_hot_path(self):
+        SimulatedBackend.configure()
+        with override_settings(CRYPTOCURRENCY_PAYMENT=simulated_settings("BITCOIN")):
+            results = run_benchmarks(payments=20, repeat=1)
+        self.assertEqual(
+            [result["name"] for result in results],
+            [
+                "get_new_address",
+                "create_new_payment",
+                "create_new_payments_bulk",
+                "update_payment_status",
+                "cancel_unpaid_payment",
+                "refresh_payment_prices",
+            ],
+        )
+        self.assertTrue(all(result["errors"] == 0 for result in results))
+        self.assertEqual(results[0]["queries"], 0)
+        out = io.StringIO()
+        print_results(results, out)
+        self.assertEqual(len(out.getvalue().splitlines()), 7)
+
+    def test_backend_errors_counted_per_payment(self):
+        SimulatedBackend.configure(error_rate=0.5, seed=1)
+        self.addCleanup(SimulatedBackend.configure)
+        with override_settings(CRYPTOCURRENCY_PAYMENT=simulated_settings("BITCOIN")):
+            results = run_benchmarks(payments=20, repeat=1)
+        update_status = [result for result in results if result["name"] == "update_payment_status"][0]
+        self.assertGreater(update_status["errors"], 1)
+        self.assertGreater(update_status["throughput"], 0)
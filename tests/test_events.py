@@ -0,0 +1,107 @@
+import json
+import unittest
+
+import django
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.shortcuts import reverse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from cryptocurrency_payment.views import CryptoPaymentEventsView, events_enabled
+from cryptocurrency_payment.events import PaymentEventStream
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+
+
+def status_events(messages):
+    return [
+        json.loads(message.split("data: ", 1)[1]) for message in messages if message.startswith("event: status")
+    ]
+
+
+class TestPaymentEventStream(TestCase):
+    def setUp(self):
+        self.payment = create_new_payment("BITCOIN", 10, "USD")
+
+    def test_payment_read_only_when_changed(self):
+        stream = PaymentEventStream(self.payment.pk, heartbeat_interval=60)
+        messages, done = stream.poll()
+        self.assertTrue(messages[0].startswith("retry: "))
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_NEW)
+        self.assertFalse(done)
+        with self.assertNumQueries(0):
+            self.assertEqual(stream.poll(), ([], False))
+
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_PROCESSING
+        self.payment.tx_hash = "hash"
+        self.payment.save()
+        messages, done = stream.poll()
+        self.assertEqual(status_events(messages)[0]["tx_hash"], "hash")
+        self.assertFalse(done)
+
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_PAID
+        self.payment.save()
+        messages, done = stream.poll()
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertTrue(done)
+
+    def test_bulk_updates_picked_up_on_refresh(self):
+        stream = PaymentEventStream(self.payment.pk, refresh_interval=0)
+        stream.poll()
+        CryptoCurrencyPayment.objects.filter(pk=self.payment.pk).update(status=CryptoCurrencyPayment.PAYMENT_CANCELLED)
+        messages, done = stream.poll()
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_CANCELLED)
+        self.assertTrue(done)
+
+    def test_stream_iterated_asynchronously(self):
+        CryptoCurrencyPayment.objects.filter(pk=self.payment.pk).update(status=CryptoCurrencyPayment.PAYMENT_PAID)
+
+        async def read():
+            return [message async for message in PaymentEventStream(self.payment.pk)]
+
+        messages = async_to_sync(read)()
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_PAID)
+
+
+class TestCryptocurrencyEventsView(TestCase):
+    def test_events_streamed_until_payment_closed(self):
+        payment = create_new_payment("BITCOIN", 10, "USD")
+        CryptoCurrencyPayment.objects.filter(pk=payment.pk).update(status=CryptoCurrencyPayment.PAYMENT_PAID)
+        response = self.client.get(reverse("cryptocurrency_payment:crypto_payment_events", args=(payment.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        messages = [message.decode() for message in response.streaming_content]
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_PAID)
+
+    def test_events_follow_detail_permissions(self):
+        user = get_user_model().objects.create_user(username="Fake_user")
+        payment = create_new_payment("BITCOIN", 10, "USD", user=user)
+        response = self.client.get(reverse("cryptocurrency_payment:crypto_payment_events", args=(payment.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+    @unittest.skipIf(django.VERSION >= (4, 2), "streamed asynchronously")
+    def test_asgi_events_sent_one_poll_per_response(self):
+        payment = create_new_payment("BITCOIN", 10, "USD")
+        url = reverse("cryptocurrency_payment:crypto_payment_events", args=(payment.pk,))
+        request = AsyncRequestFactory().get(url)
+        request.user = AnonymousUser()
+        response = CryptoPaymentEventsView.as_view()(request, pk=payment.pk)
+        messages = [message.decode() for message in response.streaming_content]
+        self.assertEqual(messages[0], "retry: 3000\n\n")
+        self.assertEqual(status_events(messages)[0]["status"], CryptoCurrencyPayment.PAYMENT_NEW)
+
+    def test_detail_page_polls_under_wsgi_unless_events_enabled(self):
+        payment = create_new_payment("BITCOIN", 10, "USD")
+        url = reverse("cryptocurrency_payment:crypto_payment_detail", args=(payment.pk,))
+        events_url = reverse("cryptocurrency_payment:crypto_payment_events", args=(payment.pk,))
+        response = self.client.get(url)
+        self.assertContains(response, "data-status-url")
+        self.assertNotContains(response, events_url)
+        with override_settings(CRYPTOCURRENCY_PAYMENT_WSGI_EVENTS=True):
+            response = self.client.get(url)
+        self.assertContains(response, 'data-events-url="{}"'.format(events_url))
+
+    def test_detail_page_polls_under_asgi_before_django_4_2(self):
+        payment = create_new_payment("BITCOIN", 10, "USD")
+        url = reverse("cryptocurrency_payment:crypto_payment_detail", args=(payment.pk,))
+        request = AsyncRequestFactory().get(url)
+        self.assertEqual(events_enabled(request), django.VERSION >= (4, 2))
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from decimal import Decimal
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.test import TestCase, override_settings
+from cryptocurrency_payment.ingest import BlockScanner, FileTransactionSource, WatchedAddresses
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+from merchant_wallet.backends.btc import BitcoinBackend
+
+from tests.test_models import crypto_settings
+
+
+class TestBlockScanner(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.payment = create_new_payment(self.crypto, 10, "USD")
+        self.other_payment = create_new_payment(self.crypto, 10, "USD")
+
+    def write_events(self, *events):
+        path = os.path.join(self.directory, "events.jsonl")
+        with open(path, "w") as events_file:
+            for event in events:
+                events_file.write(json.dumps(event) + "\n")
+        return FileTransactionSource(path)
+
+    def transaction(self, txid, address, value):
+        return {
+            "txid": txid,
+            "outputs": [{"address": "unwatched", "value": "5"}, {"address": address, "value": value}],
+        }
+
+    def block(self, height, *transactions):
+        return {"type": "block", "height": height, "transactions": list(transactions)}
+
+    def test_watched_addresses_refreshed_incrementally(self):
+        watched = WatchedAddresses(self.crypto)
+        watched.refresh()
+        self.assertIn(self.payment.address, watched)
+        new_payment = create_new_payment(self.crypto, 10, "USD")
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_CANCELLED
+        self.payment.save()
+        with self.assertNumQueries(1):
+            watched.refresh()
+        self.assertIn(new_payment.address, watched)
+        self.assertNotIn(self.payment.address, watched)
+        self.assertEqual(len(watched), 2)
+
+    def test_watched_addresses_refreshed_per_block_not_per_transaction(self):
+        scanner = BlockScanner(self.crypto, self.write_events())
+        transaction = dict(self.transaction("other", "unwatched", "1"), type="mempool")
+        scanner.process_event(transaction)
+        with self.assertNumQueries(0):
+            scanner.process_event(transaction)
+            scanner.process_event(transaction)
+        with self.assertNumQueries(1):
+            scanner.process_event(self.block(100))
+
+    def test_mempool_then_block_pays_payment_without_backend(self):
+        amount = str(self.payment.crypto_amount)
+        transaction = self.transaction("hash", self.payment.address, amount)
+        source = self.write_events(dict(transaction, type="mempool"), self.block(100, transaction))
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment"
+        ) as confirm_address_payment:
+            scanner = BlockScanner(self.crypto, source)
+            events = source.iter_events()
+            scanner.process_event(next(events))
+            self.payment.refresh_from_db()
+            self.assertEqual(self.payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+            self.assertEqual(self.payment.tx_hash, "hash")
+            scanner.process_event(next(events))
+        confirm_address_payment.assert_not_called()
+        self.payment.refresh_from_db()
+        self.other_payment.refresh_from_db()
+        self.assertEqual(self.payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(self.payment.paid_crypto_amount, Decimal(amount))
+        self.assertEqual(self.other_payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
+
+    def test_payment_paid_once_confirmed(self):
+        source = self.write_events(
+            self.block(100, self.transaction("hash", self.payment.address, str(self.payment.crypto_amount))),
+            self.block(101),
+            self.block(102),
+        )
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, BALANCE_CONFIRMATION_NUM=3)):
+            scanner = BlockScanner(self.crypto, source)
+            events = source.iter_events()
+            scanner.process_event(next(events))
+            scanner.process_event(next(events))
+            self.payment.refresh_from_db()
+            self.assertEqual(self.payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+            scanner.process_event(next(events))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(scanner.pending, {})
+
+    def test_underpaid_payment_gets_child_payment(self):
+        payment = create_new_payment(self.crypto, 100, "USD")
+        paid = payment.crypto_amount / 2
+        source = self.write_events(self.block(100, self.transaction("hash", payment.address, str(paid))))
+        BlockScanner(self.crypto, source).run()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(payment.paid_crypto_amount, payment.crypto_amount - paid)
+        self.assertIsNotNone(payment.child_payment)
+
+    def test_half_payment_does_not_pay_child_payment(self):
+        payment = create_new_payment(self.crypto, 100, "USD")
+        CryptoCurrencyPayment.objects.filter(pk=payment.pk).update(crypto_amount=Decimal("0.005"))
+        source = self.write_events(self.block(100, self.transaction("h", payment.address, "0.0025")))
+        # the child payment is created in the same instant the scan started
+        with mock.patch("django.utils.timezone.now", return_value=payment.created_at):
+            BlockScanner(self.crypto, source).run()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        child_payment = payment.child_payment
+        self.assertEqual(child_payment.address, payment.address)
+        self.assertEqual(child_payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
+        self.assertIsNone(child_payment.tx_hash)
+
+    def test_poll_only_checks_processing_payments_with_ingest_source(self):
+        CryptoCurrencyPayment.objects.filter(pk=self.payment.pk).update(
+            status=CryptoCurrencyPayment.PAYMENT_PROCESSING, tx_hash="hash"
+        )
+        ingest_settings = crypto_settings(
+            self.crypto, INGEST_SOURCE="cryptocurrency_payment.ingest.FileTransactionSource"
+        )
+        with override_settings(CRYPTOCURRENCY_PAYMENT=ingest_settings), mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.CONFIRMED_ADDRESS_BALANCE, 123),
+        ) as confirm_address_payment:
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(
+            [call[1]["address"] for call in confirm_address_payment.call_args_list], [self.payment.address]
+        )
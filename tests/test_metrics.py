@@ -0,0 +1,90 @@
+from datetime import timedelta
+import sys
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from cryptocurrency_payment.metrics import get_metrics_sink, PrometheusMetricsSink
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+from merchant_wallet.backends.btc import BitcoinBackend
+
+
+class TestPrometheusMetricsSink(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        self.sink = PrometheusMetricsSink()
+        self.sink.connect()
+        self.addCleanup(self.sink.disconnect)
+
+    def test_task_operations_and_transitions_recorded(self):
+        create_new_payment(self.crypto, 10, "USD")
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+        ):
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(self.sink.operations[("BITCOIN", "confirm_address_payment")][1], 1)
+        self.assertEqual(self.sink.operations[("BITCOIN", "update_payment_status")][1], 1)
+        self.assertIn(("BITCOIN", "get_new_address"), self.sink.operations)
+        self.assertIn(("BITCOIN", "convert_from_fiat"), self.sink.operations)
+        self.assertIn(("BITCOIN", "get_backend_obj"), self.sink.operations)
+        self.assertEqual(self.sink.transitions, {("BITCOIN", "new", "processing"): 1})
+        self.assertEqual(self.sink.errors, {})
+
+    def test_backend_errors_recorded(self):
+        create_new_payment(self.crypto, 10, "USD")
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=Exception("backend down"),
+        ):
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(self.sink.errors, {("BITCOIN", "confirm_address_payment"): 1})
+
+    def test_cancelled_payments_counted_by_old_status(self):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(3)]
+        CryptoCurrencyPayment.objects.filter(pk=payments[0].pk).update(status=CryptoCurrencyPayment.PAYMENT_WAIT)
+        CryptoCurrencyPayment.objects.update(created_at=timezone.now() - timedelta(hours=48))
+        CryptoCurrencyPaymentTask(self.crypto).cancel_unpaid_payment()
+        self.assertEqual(
+            self.sink.transitions,
+            {("BITCOIN", "new", "cancelled"): 2, ("BITCOIN", "waiting", "cancelled"): 1},
+        )
+
+    def test_render_prometheus_text(self):
+        self.sink.record_operation("BITCOIN", "confirm_address_payment", 0.02, False)
+        self.sink.record_operation("BITCOIN", "confirm_address_payment", 3, True)
+        text = self.sink.render()
+        labels = 'crypto="BITCOIN",operation="confirm_address_payment"'
+        self.assertIn('cryptocurrency_payment_operation_seconds_bucket{{{},le="0.025"}} 1'.format(labels), text)
+        self.assertIn('cryptocurrency_payment_operation_seconds_bucket{{{},le="+Inf"}} 2'.format(labels), text)
+        self.assertIn("cryptocurrency_payment_operation_seconds_count{{{}}} 2".format(labels), text)
+        self.assertIn("cryptocurrency_payment_operation_errors_total{{{}}} 1".format(labels), text)
+
+
+class TestMetricsView(TestCase):
+    def setUp(self):
+        self.url = reverse("cryptocurrency_payment:crypto_payment_metrics")
+
+    def test_metrics_not_served_by_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_served_from_sink(self):
+        with override_settings(
+            CRYPTOCURRENCY_PAYMENT_METRICS_SINK="cryptocurrency_payment.metrics.PrometheusMetricsSink",
+            CRYPTOCURRENCY_PAYMENT_METRICS_ENDPOINT=True,
+        ):
+            create_new_payment("BITCOIN", 10, "USD")
+            response = self.client.get(self.url)
+        self.assertIsNone(get_metrics_sink())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b'operation="get_new_address"', response.content)
@@ -8,13 +8,29 @@ test_django-cryptocurrency-payment
 Tests for `django-cryptocurrency-payment` models module.
 """
 
-from django.test import TestCase
+import copy
+
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from django.contrib.auth import get_user_model
 
 from cryptocurrency_payment.models import (
+    acreate_child_payment,
+    acreate_new_payment,
     create_new_payment,
     create_child_payment,
+    create_new_payments_bulk,
+    get_new_address,
+    get_new_addresses,
+    CryptoAddressPool,
+    CryptoAddressSequence,
     CryptoCurrencyPayment,
 )
 from cryptocurrency_payment.app_settings import get_backend_obj
@@ -23,6 +39,15 @@ from cryptocurrency_payment.app_settings import get_backend_obj
 from cryptocurrency_payment.test_utils.test_app.models import Invoice
 
 
+def crypto_settings(crypto, **config):
+    """
+    Copy of CRYPTOCURRENCY_PAYMENT with config changed for one crypto, to be used with override_settings
+    """
+    crypto_payment_settings = copy.deepcopy(settings.CRYPTOCURRENCY_PAYMENT)
+    crypto_payment_settings[crypto].update(config)
+    return crypto_payment_settings
+
+
 class TestCryptocurrencyModel(TestCase):
     def setUp(self):
         self.crypto = "Bitcoin"
@@ -108,6 +133,14 @@ class TestCryptocurrencyModel(TestCase):
         self.assertEqual(child_payment.parent_payment, payment)
         self.assertEqual(payment.child_payment, child_payment)
 
+    def test_create_payment_from_async_code(self):
+        payment = async_to_sync(acreate_new_payment)(self.crypto, 10, "USD", payment_title="Async")
+        self.assertEqual(CryptoCurrencyPayment.objects.get(payment_title="Async"), payment)
+        child_payment = async_to_sync(acreate_child_payment)(payment, 5)
+        payment.refresh_from_db()
+        self.assertEqual(payment.child_payment, child_payment)
+        self.assertEqual(child_payment.address, payment.address)
+
     def test_child_payment_created_gets_generic_parent_object(self):
         inv_obj = Invoice(title="Fake Invoice with payment")
         inv_obj.save()
@@ -121,9 +154,225 @@ class TestCryptocurrencyModel(TestCase):
         self.assertIn(child_payment.pk, inv_pks)
         self.assertIn(payment.pk, inv_pks)
 
+    def test_address_index_allocated_from_sequence(self):
+        create_new_payment(self.crypto, 10, "USD")
+        CryptoCurrencyPayment.objects.filter(crypto=self.crypto).delete()
+        payment = create_new_payment(self.crypto, 10, "USD")
+        self.assertEqual(payment.address, self.backend.generate_new_address(1))
+        self.assertEqual(CryptoAddressSequence.objects.get(crypto="BITCOIN").next_index, 2)
+
+    def test_sequence_starts_after_existing_payments(self):
+        create_new_payment(self.crypto, 10, "USD")
+        create_new_payment(self.crypto, 10, "USD")
+        CryptoAddressSequence.objects.all().delete()
+        self.assertEqual(CryptoAddressSequence.allocate_index(self.crypto, count=5), 2)
+        self.assertEqual(CryptoAddressSequence.allocate_index(self.crypto), 7)
+
+    def test_payments_iterated_in_chunks(self):
+        payments = [create_new_payment(self.crypto, 10, "USD", address_index=1) for _ in range(5)]
+        CryptoCurrencyPayment.objects.update(created_at=timezone.now())
+        payments.append(create_new_payment(self.crypto, 10, "USD", address_index=1))
+        with self.assertNumQueries(4):
+            chunks = list(CryptoCurrencyPayment.objects.all().iter_chunks(2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 2])
+        self.assertEqual(
+            sorted(payment.pk for chunk in chunks for payment in chunk),
+            sorted(payment.pk for payment in payments),
+        )
+        self.assertEqual(chunks[-1][-1].pk, payments[-1].pk)
+
+    def test_bulk_payments_match_single_payments(self):
+        User = get_user_model()
+        user = User.objects.create_user(username="Bulk_user")
+        inv_obj = Invoice.objects.create(title="Bulk invoice")
+        items = [
+            {"fiat_amount": 10, "fiat_currency": "USD", "payment_title": "First", "user": user},
+            {"fiat_amount": 25, "fiat_currency": "EUR", "related_object": inv_obj},
+            {"fiat_amount": 10, "fiat_currency": "USD"},
+            {"fiat_amount": 0, "fiat_currency": "USD"},
+            {"fiat_amount": 25, "fiat_currency": "EUR"},
+        ]
+        payments = create_new_payments_bulk(self.crypto, items, batch_size=2)
+        self.assertEqual(
+            [payment.address for payment in payments], [self.backend.generate_new_address(i) for i in range(5)]
+        )
+        single_payments = [
+            create_new_payment(self.crypto, item["fiat_amount"], item["fiat_currency"]) for item in items
+        ]
+        self.assertEqual(
+            [payment.crypto_amount for payment in payments], [payment.crypto_amount for payment in single_payments]
+        )
+        self.assertEqual(single_payments[0].address, self.backend.generate_new_address(5))
+        self.assertEqual(payments[0].user, user)
+        self.assertEqual(payments[0].payment_title, "First")
+        self.assertIn(payments[1].pk, [payment.pk for payment in inv_obj.payments.all()])
+        self.assertEqual(payments[3].status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(payments[2].status, CryptoCurrencyPayment.PAYMENT_NEW)
+
+    def test_bulk_payment_queries_do_not_grow_with_items(self):
+        create_new_payments_bulk(self.crypto, [{"fiat_amount": 10, "fiat_currency": "USD"}])
+        with CaptureQueriesContext(connection) as context:
+            create_new_payments_bulk(self.crypto, [{"fiat_amount": 10, "fiat_currency": "USD"}] * 2)
+        with self.assertNumQueries(len(context)):
+            payments = create_new_payments_bulk(
+                self.crypto, [{"fiat_amount": 10 + i % 3, "fiat_currency": "USD"} for i in range(20)], batch_size=100
+            )
+        self.assertEqual(len(set(payment.address for payment in payments)), 20)
+
     def test_payment_paid_when_fiat_is_zero(self):
         payment = create_new_payment(self.crypto, 0, "USD")
         self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
 
     def tearDown(self):
         pass
+
+
+class TestCryptoAddressPool(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        self.backend = get_backend_obj(self.crypto)
+
+    def test_batch_derived_addresses_match_single_derivation(self):
+        addresses = get_new_addresses(self.backend, [0, 1, 7], "p2pkh", "m/0")
+        self.assertEqual(
+            addresses,
+            [get_new_address(self.backend, index, "p2pkh", "m/0") for index in [0, 1, 7]],
+        )
+        for derivation_path in ["m", "m/0/1"]:
+            self.assertEqual(
+                get_new_addresses(self.backend, [0, 3], "p2pkh", derivation_path),
+                [get_new_address(self.backend, index, "p2pkh", derivation_path) for index in [0, 3]],
+            )
+
+    def test_payment_claims_address_from_pool(self):
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, ADDRESS_POOL_SIZE=3)):
+            payment = create_new_payment(self.crypto, 10, "USD")
+            payment_two = create_new_payment(self.crypto, 10, "USD")
+        self.assertEqual(payment.address, self.backend.generate_new_address(0))
+        self.assertEqual(payment_two.address, self.backend.generate_new_address(1))
+        self.assertEqual(CryptoAddressPool.get_free_count(self.crypto, "p2pkh", "m/0"), 1)
+
+    def test_pool_continues_after_generated_addresses(self):
+        create_new_payment(self.crypto, 10, "USD")
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, ADDRESS_POOL_SIZE=2)):
+            payment = create_new_payment(self.crypto, 10, "USD")
+        self.assertEqual(payment.address, self.backend.generate_new_address(1))
+
+    def test_pool_is_separate_per_derivation_path(self):
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, ADDRESS_POOL_SIZE=2)):
+            create_new_payment(self.crypto, 10, "USD")
+        with override_settings(
+            CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, ADDRESS_POOL_SIZE=2, DERIVATION_PATH="m/1")
+        ):
+            payment = create_new_payment(self.crypto, 10, "USD")
+        self.assertEqual(payment.address, get_new_address(self.backend, 2, "p2pkh", "m/1"))
+        self.assertEqual(CryptoAddressPool.get_free_count(self.crypto, "p2pkh", "m/0"), 1)
+
+
+class TestCryptocurrencyPaymentIndexes(TestCase):
+    """
+    The task and view queries should be answered from the payment indexes, not from a table scan
+    """
+
+    def setUp(self):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.skipTest("Query plans are only checked on SQLite and PostgreSQL")
+        self.crypto = "BITCOIN"
+        self.since = timezone.now() - timedelta(hours=24)
+
+    def assertUsesIndex(self, queryset, *index_names):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertTrue(
+            any(index_name in plan for index_name in index_names),
+            "{} not used in plan {}".format(" or ".join(index_names), plan),
+        )
+
+    def test_open_payments_use_status_index(self):
+        # SQLite only uses a partial index when the query repeats its condition literally,
+        # bound status parameters fall back to the composite index there
+        self.assertUsesIndex(
+            CryptoCurrencyPayment.objects.filter(
+                crypto=self.crypto,
+                status__in=CryptoCurrencyPayment.OPEN_STATUSES,
+                created_at__gte=self.since,
+            ),
+            "crypto_pay_open_idx",
+            "crypto_pay_status_created_idx",
+        )
+
+    def test_cancel_payments_use_status_created_index(self):
+        self.assertUsesIndex(
+            CryptoCurrencyPayment.objects.filter(
+                crypto=self.crypto,
+                status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT],
+                created_at__lte=self.since,
+            ),
+            "crypto_pay_status_created_idx",
+        )
+
+    def test_refresh_and_reused_address_use_status_updated_index(self):
+        self.assertUsesIndex(
+            CryptoCurrencyPayment.objects.filter(
+                crypto=self.crypto,
+                status__in=[CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_WAIT],
+                updated_at__lte=self.since,
+            ),
+            "crypto_pay_status_updated_idx",
+        )
+        self.assertUsesIndex(
+            CryptoCurrencyPayment.objects.filter(
+                crypto=self.crypto, status=CryptoCurrencyPayment.PAYMENT_PAID
+            ).order_by("updated_at"),
+            "crypto_pay_status_updated_idx",
+        )
+
+    def test_address_and_tx_hash_lookups_use_index(self):
+        self.assertUsesIndex(CryptoCurrencyPayment.objects.filter(address="address"), "crypto_pay_address_idx")
+        self.assertUsesIndex(CryptoCurrencyPayment.objects.filter(tx_hash="hash"), "crypto_pay_tx_hash_idx")
+
+
+class TestCryptocurrencyPaymentChain(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        self.chain = [create_new_payment(self.crypto, 100, "USD")]
+        for fiat_amount in [50, 20, 5]:
+            parent_payment = self.chain[-1]
+            parent_payment.status = CryptoCurrencyPayment.PAYMENT_PAID
+            parent_payment.paid_crypto_amount = parent_payment.crypto_amount / 2
+            self.chain.append(create_child_payment(parent_payment, fiat_amount))
+        self.other_payment = create_new_payment(self.crypto, 10, "USD")
+
+    def test_chain_loaded_in_one_query_from_any_payment(self):
+        for payment in self.chain:
+            payment = CryptoCurrencyPayment.objects.get(pk=payment.pk)
+            with self.assertNumQueries(1):
+                chain = payment.get_chain()
+                self.assertEqual([chain_payment.pk for chain_payment in chain], [p.pk for p in self.chain])
+                self.assertEqual([chain_payment.child_payment for chain_payment in chain], self.chain[1:] + [None])
+                self.assertEqual([chain_payment.parent_payment for chain_payment in chain], [None] + self.chain[:-1])
+                self.assertEqual(payment.child_payment, chain[chain.index(payment)].child_payment)
+
+    def test_queryset_with_chain(self):
+        with self.assertNumQueries(2):
+            payments = list(
+                CryptoCurrencyPayment.objects.filter(
+                    pk__in=[self.chain[0].pk, self.chain[2].pk, self.other_payment.pk]
+                ).with_chain()
+            )
+            chains = {payment.pk: [chain_payment.pk for chain_payment in payment.get_chain()] for payment in payments}
+        self.assertEqual(chains[self.chain[0].pk], [payment.pk for payment in self.chain])
+        self.assertEqual(chains[self.chain[2].pk], [payment.pk for payment in self.chain])
+        self.assertEqual(chains[self.other_payment.pk], [self.other_payment.pk])
+
+    def test_chain_totals(self):
+        totals = CryptoCurrencyPayment.objects.get(pk=self.chain[1].pk).get_chain_totals()
+        self.assertEqual(totals["payments"], 4)
+        self.assertEqual(totals["crypto_amount"], self.chain[0].crypto_amount)
+        self.assertEqual(
+            totals["paid_crypto_amount"], sum(payment.crypto_amount / 2 for payment in self.chain[:-1])
+        )
+        self.assertEqual(totals["remaining_crypto_amount"], self.chain[-1].crypto_amount)
+        self.assertEqual(totals["status"], CryptoCurrencyPayment.PAYMENT_NEW)
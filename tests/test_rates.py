@@ -0,0 +1,66 @@
+from decimal import Decimal
+import sys
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.rates import ExchangeRates
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+
+from tests.test_models import crypto_settings
+
+
+def fake_convert_to_fiat(amount, currency):
+    rates = {"USD": Decimal("20000.50"), "EUR": Decimal("18000")}
+    return round(Decimal(amount) * rates[currency], 2)
+
+
+@mock.patch(
+    "merchant_wallet.backends.btc.BitcoinBackend.convert_to_fiat",
+    side_effect=fake_convert_to_fiat,
+)
+@override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings("BITCOIN", EXCHANGE_RATE_TTL=60))
+class TestExchangeRates(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        cache.clear()
+
+    def test_conversions_use_one_rate(self, convert_to_fiat):
+        exchange_rates = ExchangeRates(self.crypto)
+        self.assertEqual(exchange_rates.convert_from_fiat(10, "USD"), Decimal("0.00049999"))
+        self.assertEqual(exchange_rates.convert_from_fiat(100, "USD"), Decimal("0.00499988"))
+        self.assertEqual(exchange_rates.convert_to_fiat(Decimal("0.5"), "USD"), Decimal("10000.25"))
+        self.assertEqual(convert_to_fiat.call_count, 1)
+
+    def test_rate_shared_through_cache(self, convert_to_fiat):
+        create_new_payment(self.crypto, 10, "USD")
+        create_new_payment(self.crypto, 20, "USD")
+        payment = create_new_payment(self.crypto, 20, "EUR")
+        self.assertEqual(payment.crypto_amount, Decimal("0.00111111"))
+        self.assertEqual(convert_to_fiat.call_count, 2)
+
+    def test_price_refresh_fetches_rate_once(self, convert_to_fiat):
+        for fiat_amount in (10, 20, 30):
+            create_new_payment(self.crypto, fiat_amount, "USD")
+        CryptoCurrencyPayment.objects.update(crypto_amount=0, updated_at="2000-01-01T00:00:00Z")
+        cache.clear()
+        convert_to_fiat.reset_mock()
+        self.assertEqual(CryptoCurrencyPaymentTask(self.crypto).refresh_new_crypto_payment_amount(), 3)
+        self.assertEqual(convert_to_fiat.call_count, 1)
+        self.assertEqual(
+            sorted(CryptoCurrencyPayment.objects.values_list("crypto_amount", flat=True)),
+            [Decimal("0.00049999"), Decimal("0.00099998"), Decimal("0.00149996")],
+        )
+
+    def test_backend_rate_used_when_available(self, convert_to_fiat):
+        exchange_rates = ExchangeRates(self.crypto)
+        exchange_rates.backend.get_exchange_rate = mock.Mock(return_value=Decimal("25000"))
+        self.assertEqual(exchange_rates.convert_to_fiat(1, "USD"), Decimal("25000.00"))
+        self.assertEqual(convert_to_fiat.call_count, 0)
@@ -1,5 +1,8 @@
 from datetime import timedelta
+from decimal import Decimal
 import sys
+import threading
+import time
 
 if sys.version_info >= (3, 3):
 
@@ -7,18 +10,25 @@ if sys.version_info >= (3, 3):
 else:
     import mock
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
 from django.utils import timezone
-from cryptocurrency_payment.models import create_new_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.models import create_new_payment, CryptoAddressPool, CryptoCurrencyPayment, PaymentTaskRun
 from cryptocurrency_payment.tasks import (
+    aupdate_payment_status,
     cancel_unpaid_payment,
+    refill_address_pool,
     refresh_payment_prices,
     update_payment_status,
     CryptoCurrencyPaymentTask,
 )
 
+from tests.test_models import crypto_settings
+
 from merchant_wallet.backends.btc import BitcoinBackend
 
+from cryptocurrency_payment.test_utils.backends import FakeAsyncBackend, FakeBackend, FakeBatchBackend
+
 
 fake_payment_paid_status = [
     (BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
@@ -31,6 +41,28 @@ underpaid_payment_status = [
 no_payment_status = [(BitcoinBackend.NO_HASH_ADDRESS_BALANCE, None)]
 
 
+class SlowConfirmAddressPayment:
+    """
+    Stand in for confirm_address_payment that takes latency seconds and records how many calls overlap
+    """
+
+    def __init__(self, results, latency=0.05):
+        self.results = results
+        self.latency = latency
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, address, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.latency)
+        with self.lock:
+            self.running -= 1
+        return self.results[address]
+
+
 class TestCryptocurrencyTask(TestCase):
     def setUp(self):
         self.crypto = "BITCOIN"
@@ -48,6 +80,18 @@ class TestCryptocurrencyTask(TestCase):
         self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
         self.assertEqual(payment_two.status, CryptoCurrencyPayment.PAYMENT_CANCELLED)
 
+    def test_cancel_old_payment_only_for_task_crypto(self):
+        payment = create_new_payment(self.crypto, 10, "USD")
+        payment_two = create_new_payment("BITCOINTEST", 10, "USD")
+        created_at = timezone.now() - timedelta(hours=48)
+        CryptoCurrencyPayment.objects.update(created_at=created_at)
+        payment_task = CryptoCurrencyPaymentTask(self.crypto)
+        self.assertEqual(payment_task.cancel_unpaid_payment(), 1)
+        payment.refresh_from_db()
+        payment_two.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_CANCELLED)
+        self.assertEqual(payment_two.status, CryptoCurrencyPayment.PAYMENT_NEW)
+
     def test_cancel_old_payment_task(self):
         payment = create_new_payment(self.crypto, 10, "USD")
         payment_two = create_new_payment(self.crypto, 10, "USD")
@@ -62,8 +106,8 @@ class TestCryptocurrencyTask(TestCase):
         self.assertEqual(payment_two.status, CryptoCurrencyPayment.PAYMENT_CANCELLED)
 
     @mock.patch(
-        "merchant_wallet.backends.btc.BitcoinBackend.convert_from_fiat",
-        side_effect=[20, 50],
+        "cryptocurrency_payment.rates.fetch_exchange_rate",
+        side_effect=[Decimal("0.5"), Decimal("0.2")],
     )
     def test_prices_get_refreshed(self, convert_fiat_side):
         payment = create_new_payment(self.crypto, 10, "USD")
@@ -76,13 +120,28 @@ class TestCryptocurrencyTask(TestCase):
         CryptoCurrencyPayment.objects.filter(pk=payment.pk).update(
             updated_at=updated_at
         )
-        payment_task.refresh_new_crypto_payment_amount()
+        self.assertEqual(payment_task.refresh_new_crypto_payment_amount(), 1)
         payment.refresh_from_db()
         self.assertEqual(payment.crypto_amount, 50)
+        self.assertGreater(payment.updated_at, updated_at)
+
+    def test_prices_refreshed_in_chunks(self):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(5)]
+        CryptoCurrencyPayment.objects.update(
+            crypto_amount=0, updated_at=timezone.now() - timedelta(minutes=1000)
+        )
+        with mock.patch.object(CryptoCurrencyPaymentTask, "CHUNK_SIZE", 2), mock.patch(
+            "cryptocurrency_payment.rates.fetch_exchange_rate", return_value=Decimal(5)
+        ) as fetch_exchange_rate:
+            self.assertEqual(CryptoCurrencyPaymentTask(self.crypto).refresh_new_crypto_payment_amount(), 5)
+        self.assertEqual(fetch_exchange_rate.call_count, 1)
+        for payment in payments:
+            payment.refresh_from_db()
+            self.assertEqual(payment.crypto_amount, 2)
 
     @mock.patch(
-        "merchant_wallet.backends.btc.BitcoinBackend.convert_from_fiat",
-        side_effect=[20, 50],
+        "cryptocurrency_payment.rates.fetch_exchange_rate",
+        side_effect=[Decimal("0.5"), Decimal("0.2")],
     )
     def test_refresh_prices_task(self, convert_fiat_side):
         payment = create_new_payment(self.crypto, 10, "USD")
@@ -94,7 +153,7 @@ class TestCryptocurrencyTask(TestCase):
         CryptoCurrencyPayment.objects.filter(pk=payment.pk).update(
             updated_at=updated_at
         )
-        refresh_payment_prices()
+        self.assertEqual(refresh_payment_prices(), {"BITCOIN": 1, "BITCOINTEST": 0})
         payment.refresh_from_db()
         self.assertEqual(payment.crypto_amount, 50)
 
@@ -132,8 +191,8 @@ class TestCryptocurrencyTask(TestCase):
         self.assertEqual(payment.paid_crypto_amount, 123)
 
     @mock.patch(
-        "merchant_wallet.backends.btc.BitcoinBackend.convert_to_fiat",
-        side_effect=[2, 150],
+        "cryptocurrency_payment.rates.fetch_exchange_rate",
+        return_value=Decimal(2),
     )
     @mock.patch(
         "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
@@ -152,8 +211,8 @@ class TestCryptocurrencyTask(TestCase):
         self.assertIsNone(payment.child_payment)
 
     @mock.patch(
-        "merchant_wallet.backends.btc.BitcoinBackend.convert_to_fiat",
-        side_effect=[150, 1],
+        "cryptocurrency_payment.rates.fetch_exchange_rate",
+        return_value=Decimal(150),
     )
     @mock.patch(
         "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
@@ -172,6 +231,19 @@ class TestCryptocurrencyTask(TestCase):
         self.assertIsNotNone(payment.child_payment)
         self.assertEqual(payment.child_payment.parent_payment, payment)
 
+    @mock.patch("cryptocurrency_payment.rates.fetch_exchange_rate", return_value=Decimal(150))
+    @mock.patch(
+        "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+        return_value=(BitcoinBackend.UNDERPAID_ADDRESS_BALANCE, 1),
+    )
+    def test_child_payment_left_to_next_run(self, confirm_address_payment, fetch_exchange_rate):
+        payment = create_new_payment(self.crypto, 1000, "USD")
+        CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(confirm_address_payment.call_count, 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(payment.child_payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
+
     @mock.patch(
         "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
         side_effect=no_payment_status,
@@ -183,3 +255,396 @@ class TestCryptocurrencyTask(TestCase):
         payment_task.update_crypto_currency_payment_status()
         payment.refresh_from_db()
         self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_CANCELLED)
+
+    def test_refill_address_pool_up_to_low_water(self):
+        pool_settings = crypto_settings(self.crypto, ADDRESS_POOL_SIZE=4, ADDRESS_POOL_LOW_WATER=2)
+        with override_settings(CRYPTOCURRENCY_PAYMENT=pool_settings):
+            refill_address_pool()
+            self.assertEqual(CryptoAddressPool.get_free_count(self.crypto, "p2pkh", "m/0"), 4)
+            create_new_payment(self.crypto, 10, "USD")
+            create_new_payment(self.crypto, 10, "USD")
+            payment_task = CryptoCurrencyPaymentTask(self.crypto)
+            self.assertEqual(payment_task.refill_address_pool(), 0)
+            create_new_payment(self.crypto, 10, "USD")
+            self.assertEqual(payment_task.refill_address_pool(), 3)
+        self.assertEqual(CryptoAddressPool.get_free_count(self.crypto, "p2pkh", "m/0"), 4)
+        self.assertEqual(CryptoAddressPool.objects.count(), 7)
+
+    def check_payments_with_slow_backend(self, poll_concurrency):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(6)]
+        results = {}
+        for index, payment in enumerate(payments):
+            results[payment.address] = [
+                (BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash{}".format(index)),
+                (BitcoinBackend.NO_HASH_ADDRESS_BALANCE, None),
+                (BitcoinBackend.CONFIRMED_ADDRESS_BALANCE, index),
+            ][index % 3]
+        slow_confirm = SlowConfirmAddressPayment(results)
+        poll_settings = crypto_settings(self.crypto, POLL_CONCURRENCY=poll_concurrency)
+        with override_settings(CRYPTOCURRENCY_PAYMENT=poll_settings), mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=slow_confirm,
+        ):
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        updated = [
+            CryptoCurrencyPayment.objects.values_list("status", "tx_hash", "paid_crypto_amount").get(pk=payment.pk)
+            for payment in payments
+        ]
+        CryptoCurrencyPayment.objects.all().delete()
+        return updated, slow_confirm.max_running
+
+    def test_concurrent_status_update_matches_sequential(self):
+        sequential, sequential_running = self.check_payments_with_slow_backend(1)
+        concurrent, concurrent_running = self.check_payments_with_slow_backend(3)
+        self.assertEqual(sequential, concurrent)
+        self.assertEqual(sequential_running, 1)
+        self.assertGreater(concurrent_running, 1)
+        self.assertLessEqual(concurrent_running, 3)
+
+    def test_shared_address_polled_once(self):
+        payments = [create_new_payment(self.crypto, 10, "USD", address_index=9) for _ in range(3)]
+        payments.append(create_new_payment(self.crypto, 10, "USD"))
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+        ) as confirm_address_payment:
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(confirm_address_payment.call_count, 2)
+        for payment in payments:
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+            self.assertEqual(payment.tx_hash, "hash")
+
+    def test_shared_address_with_different_amount_polled_again_when_paid(self):
+        payment = create_new_payment(self.crypto, 10, "USD", address_index=9)
+        payment_two = create_new_payment(self.crypto, 10, "USD", address_index=9)
+        payment_three = create_new_payment(self.crypto, 10, "USD", address_index=9)
+        CryptoCurrencyPayment.objects.filter(pk=payment_three.pk).update(crypto_amount=5)
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=[
+                (BitcoinBackend.CONFIRMED_ADDRESS_BALANCE, 123),
+                (BitcoinBackend.CONFIRMED_ADDRESS_BALANCE, 5),
+            ],
+        ) as confirm_address_payment:
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(confirm_address_payment.call_count, 2)
+        self.assertEqual(confirm_address_payment.call_args[1]["total_crypto_amount"], 5)
+        for updated_payment, paid_amount in ((payment, 123), (payment_two, 123), (payment_three, 5)):
+            updated_payment.refresh_from_db()
+            self.assertEqual(updated_payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+            self.assertEqual(updated_payment.paid_crypto_amount, paid_amount)
+
+    def test_payments_leased_by_another_worker_skipped(self):
+        payment = create_new_payment(self.crypto, 10, "USD")
+        payment_two = create_new_payment(self.crypto, 10, "USD")
+        lease_token, leased, _ = CryptoCurrencyPayment.objects.filter(pk=payment.pk).claim(10, 60)
+        self.assertEqual(leased, [payment])
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+        ) as confirm_address_payment:
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        self.assertEqual(confirm_address_payment.call_count, 1)
+        payment.refresh_from_db()
+        payment_two.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
+        self.assertEqual(payment.lease_owner, lease_token)
+        self.assertEqual(payment_two.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+        self.assertIsNone(payment_two.lease_owner)
+
+    def test_expired_lease_picked_up(self):
+        payment = create_new_payment(self.crypto, 10, "USD")
+        CryptoCurrencyPayment.objects.filter(pk=payment.pk).claim(10, 60)
+        CryptoCurrencyPayment.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+        ):
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+        self.assertIsNone(payment.lease_owner)
+
+    def test_payments_claimed_once(self):
+        for _ in range(3):
+            create_new_payment(self.crypto, 10, "USD")
+        payments = CryptoCurrencyPayment.objects.all()
+        _, leased, last_payment = payments.claim(2, 60)
+        _, leased_two, last_payment_two = payments.claim(2, 60)
+        _, leased_three, last_payment_three = payments.claim(2, 60)
+        self.assertEqual(len(leased), 2)
+        self.assertEqual(len(leased_two), 1)
+        self.assertEqual(leased_three, [])
+        self.assertIsNone(last_payment_three)
+        self.assertEqual(last_payment_two, (leased_two[0].created_at, leased_two[0].pk))
+
+    def test_payments_checked_again_when_due(self):
+        schedule_settings = crypto_settings(
+            self.crypto,
+            BLOCK_INTERVAL_SECONDS=600,
+            POLL_MIN_INTERVAL_SECONDS=60,
+            POLL_BACKOFF_AFTER_SECONDS=3600,
+            POLL_MAX_INTERVAL_SECONDS=1800,
+        )
+        processing_payment = create_new_payment(self.crypto, 10, "USD")
+        waiting_payment = create_new_payment(self.crypto, 10, "USD")
+        results = {
+            processing_payment.address: (BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"),
+            waiting_payment.address: (BitcoinBackend.NO_HASH_ADDRESS_BALANCE, None),
+        }
+        with override_settings(CRYPTOCURRENCY_PAYMENT=schedule_settings), mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=lambda address, **kwargs: results[address],
+        ) as confirm_address_payment:
+            payment_task = CryptoCurrencyPaymentTask(self.crypto)
+            before_check = timezone.now()
+            payment_task.update_crypto_currency_payment_status()
+            payment_task.update_crypto_currency_payment_status()
+            self.assertEqual(confirm_address_payment.call_count, 2)
+            processing_payment.refresh_from_db()
+            waiting_payment.refresh_from_db()
+            self.assertGreaterEqual(processing_payment.next_check_at, before_check + timedelta(seconds=600))
+            self.assertGreaterEqual(waiting_payment.next_check_at, before_check + timedelta(seconds=60))
+            self.assertLess(waiting_payment.next_check_at, before_check + timedelta(seconds=600))
+            CryptoCurrencyPayment.objects.filter(pk=waiting_payment.pk).update(next_check_at=timezone.now())
+            payment_task.update_crypto_currency_payment_status()
+            self.assertEqual(confirm_address_payment.call_count, 3)
+
+    def test_waiting_payment_check_interval_grows_with_age(self):
+        schedule_settings = crypto_settings(
+            self.crypto, POLL_MIN_INTERVAL_SECONDS=60, POLL_BACKOFF_AFTER_SECONDS=3600, POLL_MAX_INTERVAL_SECONDS=1800
+        )
+        payment = create_new_payment(self.crypto, 10, "USD")
+        payment.status = CryptoCurrencyPayment.PAYMENT_WAIT
+        with override_settings(CRYPTOCURRENCY_PAYMENT=schedule_settings):
+            payment_task = CryptoCurrencyPaymentTask(self.crypto)
+        for age_hours, interval in ((0, 60), (1, 120), (3, 480), (20, 1800)):
+            now = payment.created_at + timedelta(hours=age_hours)
+            self.assertEqual(payment_task.get_next_check_at(payment, now), now + timedelta(seconds=interval))
+        payment.status = CryptoCurrencyPayment.PAYMENT_PAID
+        self.assertIsNone(payment_task.get_next_check_at(payment))
+
+    def test_old_payment_backoff_without_max_interval(self):
+        schedule_settings = crypto_settings(self.crypto, POLL_MIN_INTERVAL_SECONDS=60, POLL_BACKOFF_AFTER_SECONDS=60)
+        payment = create_new_payment(self.crypto, 10, "USD")
+        payment.status = CryptoCurrencyPayment.PAYMENT_WAIT
+        with override_settings(CRYPTOCURRENCY_PAYMENT=schedule_settings):
+            payment_task = CryptoCurrencyPaymentTask(self.crypto)
+        now = payment.created_at + timedelta(hours=20)
+        self.assertEqual(payment_task.get_next_check_at(payment, now), now + timedelta(seconds=60 * 2 ** 10))
+
+    def test_cancel_payments_single_update(self):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(3)]
+        CryptoCurrencyPayment.objects.filter(pk=payments[1].pk).update(status=CryptoCurrencyPayment.PAYMENT_WAIT)
+        CryptoCurrencyPayment.objects.filter(pk=payments[2].pk).update(
+            status=CryptoCurrencyPayment.PAYMENT_PROCESSING
+        )
+        payment_task = CryptoCurrencyPaymentTask(self.crypto)
+        with mock.patch("cryptocurrency_payment.tasks.payment_status_changed") as status_changed:
+            with self.assertNumQueries(2):
+                cancelled = payment_task.cancel_payments(CryptoCurrencyPayment.objects.filter(crypto=self.crypto))
+        self.assertEqual(cancelled, 2)
+        self.assertEqual(
+            [(call[1]["old_status"], call[1]["count"]) for call in status_changed.send.call_args_list],
+            [(CryptoCurrencyPayment.PAYMENT_NEW, 1), (CryptoCurrencyPayment.PAYMENT_WAIT, 1)],
+        )
+        self.assertEqual(
+            CryptoCurrencyPayment.objects.get(pk=payments[2].pk).status, CryptoCurrencyPayment.PAYMENT_PROCESSING
+        )
+
+    def test_notified_processing_payment_keeps_block_interval(self):
+        schedule_settings = crypto_settings(self.crypto, BLOCK_INTERVAL_SECONDS=600, NOTIFY_POLL_DELAY_SECONDS=3600)
+        payment = create_new_payment(self.crypto, 10, "USD")
+        with override_settings(CRYPTOCURRENCY_PAYMENT=schedule_settings):
+            payment_task = CryptoCurrencyPaymentTask(self.crypto)
+        now = payment.created_at
+        payment.status = CryptoCurrencyPayment.PAYMENT_PROCESSING
+        self.assertEqual(payment_task.get_next_check_at(payment, now, notified=True), now + timedelta(seconds=600))
+        payment.status = CryptoCurrencyPayment.PAYMENT_WAIT
+        self.assertEqual(payment_task.get_next_check_at(payment, now, notified=True), now + timedelta(seconds=3600))
+
+
+class TestCryptocurrencyTaskBatching(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        FakeBatchBackend.reset()
+
+    def update_payment_status_with(self, backend, batch_failures=(), **config):
+        backend_path = "{}.{}".format(backend.__module__, backend.__name__)
+        with override_settings(
+            CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, BACKEND=backend_path, **config)
+        ):
+            payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(5)]
+            for index, payment in enumerate(payments):
+                backend.address_results[payment.address] = (
+                    backend.UNCONFIRMED_ADDRESS_BALANCE,
+                    "hash{}".format(index),
+                )
+                if index in batch_failures:
+                    backend.batch_failures.add(payment.address)
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+        for index, payment in enumerate(payments):
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PROCESSING)
+            self.assertEqual(payment.tx_hash, "hash{}".format(index))
+        return payments
+
+    def test_addresses_confirmed_in_batches(self):
+        payments = self.update_payment_status_with(FakeBatchBackend, POLL_BATCH_SIZE=2)
+        addresses = [payment.address for payment in payments]
+        self.assertEqual(FakeBatchBackend.calls, [addresses[0:2], addresses[2:4], addresses[4:]])
+
+    def test_failed_batch_addresses_confirmed_one_by_one(self):
+        payments = self.update_payment_status_with(
+            FakeBatchBackend, batch_failures=(1, 3), POLL_BATCH_SIZE=5, POLL_CONCURRENCY=2
+        )
+        addresses = [payment.address for payment in payments]
+        self.assertEqual(FakeBatchBackend.calls, [addresses, [addresses[1]], [addresses[3]]])
+
+    def test_backend_without_batch_confirmed_per_address(self):
+        FakeBackend.reset()
+        payments = self.update_payment_status_with(FakeBackend, POLL_BATCH_SIZE=2)
+        self.assertEqual(FakeBackend.calls, [[payment.address] for payment in payments])
+
+
+class TestAsyncPaymentStatus(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+
+    def payment_results(self, payments):
+        return [
+            CryptoCurrencyPayment.objects.values_list("status", "tx_hash").get(pk=payment.pk) for payment in payments
+        ]
+
+    def test_async_backend_polled_concurrently_on_loop(self):
+        FakeAsyncBackend.reset()
+        FakeAsyncBackend.latency = 0.02
+        backend_path = "cryptocurrency_payment.test_utils.backends.FakeAsyncBackend"
+        with override_settings(
+            CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, BACKEND=backend_path, ASYNC_POLL_CONCURRENCY=3)
+        ):
+            payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(6)]
+            for index, payment in enumerate(payments):
+                FakeAsyncBackend.address_results[payment.address] = (
+                    FakeAsyncBackend.UNCONFIRMED_ADDRESS_BALANCE,
+                    "hash{}".format(index),
+                )
+            async_to_sync(aupdate_payment_status)()
+        self.assertEqual(FakeAsyncBackend.max_running, 3)
+        self.assertEqual(
+            self.payment_results(payments),
+            [(CryptoCurrencyPayment.PAYMENT_PROCESSING, "hash{}".format(index)) for index in range(6)],
+        )
+        self.assertEqual(PaymentTaskRun.objects.get(crypto=self.crypto).backend_calls, 6)
+
+    def test_sync_backend_offloaded_to_threads(self):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(4)]
+        slow_confirm = SlowConfirmAddressPayment(
+            {payment.address: (BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, payment.address) for payment in payments}
+        )
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment", side_effect=slow_confirm
+        ):
+            checked = async_to_sync(CryptoCurrencyPaymentTask(self.crypto).aupdate_payments_status)(
+                CryptoCurrencyPayment.objects.all()
+            )
+        self.assertEqual(checked, 4)
+        self.assertGreater(slow_confirm.max_running, 1)
+        self.assertEqual(
+            self.payment_results(payments),
+            [(CryptoCurrencyPayment.PAYMENT_PROCESSING, payment.address) for payment in payments],
+        )
+
+    @mock.patch("cryptocurrency_payment.rates.fetch_exchange_rate", return_value=Decimal(150))
+    @mock.patch(
+        "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+        return_value=(BitcoinBackend.UNDERPAID_ADDRESS_BALANCE, 1),
+    )
+    def test_child_payment_left_to_next_run(self, confirm_address_payment, fetch_exchange_rate):
+        payment = create_new_payment(self.crypto, 1000, "USD")
+        async_to_sync(CryptoCurrencyPaymentTask(self.crypto).aupdate_payments_status)(
+            CryptoCurrencyPayment.objects.all()
+        )
+        self.assertEqual(confirm_address_payment.call_count, 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, CryptoCurrencyPayment.PAYMENT_PAID)
+        self.assertEqual(payment.child_payment.status, CryptoCurrencyPayment.PAYMENT_NEW)
+
+    def test_batch_backend_confirmed_in_batches(self):
+        FakeBatchBackend.reset()
+        backend_path = "cryptocurrency_payment.test_utils.backends.FakeBatchBackend"
+        with override_settings(
+            CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, BACKEND=backend_path, POLL_BATCH_SIZE=2)
+        ):
+            payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(3)]
+            async_to_sync(CryptoCurrencyPaymentTask(self.crypto).aupdate_payments_status)(
+                CryptoCurrencyPayment.objects.all()
+            )
+        addresses = [payment.address for payment in payments]
+        self.assertEqual(sorted(FakeBatchBackend.calls), sorted([addresses[0:2], addresses[2:]]))
+        self.assertEqual(
+            self.payment_results(payments), [(CryptoCurrencyPayment.PAYMENT_WAIT, None) for payment in payments]
+        )
+
+
+class TestPaymentTaskRun(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+
+    def test_runs_recorded_with_counts(self):
+        create_new_payment(self.crypto, 10, "USD")
+        create_new_payment(self.crypto, 10, "USD")
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=[(BitcoinBackend.UNCONFIRMED_ADDRESS_BALANCE, "hash"), no_payment_status[0]],
+        ):
+            update_payment_status()
+        run = PaymentTaskRun.objects.get(task="update_payment_status", crypto=self.crypto)
+        self.assertEqual(run.status, PaymentTaskRun.RUN_FINISHED)
+        self.assertEqual((run.rows_scanned, run.rows_changed, run.backend_calls, run.errors), (2, 2, 2, 0))
+        self.assertIsNotNone(run.duration)
+        self.assertEqual(PaymentTaskRun.objects.filter(task="update_payment_status").count(), 2)
+
+    def test_run_skipped_while_previous_in_progress(self):
+        PaymentTaskRun.objects.create(task="cancel_unpaid_payment", crypto=self.crypto)
+        self.assertEqual(cancel_unpaid_payment(), {"BITCOIN": None, "BITCOINTEST": 0})
+        with override_settings(CRYPTOCURRENCY_PAYMENT=crypto_settings(self.crypto, TASK_RUN_CONCURRENCY=2)):
+            self.assertEqual(cancel_unpaid_payment()["BITCOIN"], 0)
+
+    def test_stale_run_does_not_block(self):
+        stale_run = PaymentTaskRun.objects.create(
+            task="refresh_payment_prices", crypto=self.crypto, started_at=timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(refresh_payment_prices()["BITCOIN"], 0)
+        stale_run.refresh_from_db()
+        self.assertEqual(stale_run.status, PaymentTaskRun.RUN_FAILED)
+
+    def test_failed_run_recorded(self):
+        create_new_payment(self.crypto, 10, "USD")
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=fake_payment_paid_status[0],
+        ), mock.patch.object(CryptoCurrencyPaymentTask, "update_payment", side_effect=Exception("down")):
+            with self.assertRaises(Exception):
+                update_payment_status()
+        run = PaymentTaskRun.objects.get(task="update_payment_status", crypto=self.crypto)
+        self.assertEqual(run.status, PaymentTaskRun.RUN_FAILED)
+        self.assertEqual((run.backend_calls, run.errors), (1, 1))
+
+    def test_backend_errors_counted_and_run_goes_on(self):
+        payments = [create_new_payment(self.crypto, 10, "USD") for _ in range(2)]
+        with mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            side_effect=[Exception("down"), fake_payment_paid_status[0]],
+        ):
+            update_payment_status()
+        run = PaymentTaskRun.objects.get(task="update_payment_status", crypto=self.crypto)
+        self.assertEqual(run.status, PaymentTaskRun.RUN_FINISHED)
+        self.assertEqual((run.backend_calls, run.errors, run.rows_changed), (2, 1, 1))
+        statuses = dict(CryptoCurrencyPayment.objects.filter(crypto=self.crypto).values_list("pk", "status"))
+        self.assertEqual(
+            sorted(statuses[payment.pk] for payment in payments),
+            [CryptoCurrencyPayment.PAYMENT_NEW, CryptoCurrencyPayment.PAYMENT_PROCESSING],
+        )
+        self.assertIsNotNone(PaymentTaskRun.start("update_payment_status", self.crypto))
@@ -1,7 +1,28 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+import hashlib
+import hmac
+import json
+import sys
+
+if sys.version_info >= (3, 3):
+
+    from unittest import mock
+else:
+    import mock
+
+from django.test import TestCase, override_settings
 from django.shortcuts import reverse
 from django.contrib.auth import get_user_model
-from cryptocurrency_payment.models import create_new_payment, create_child_payment
+from django.utils import timezone
+from cryptocurrency_payment import qr
+from cryptocurrency_payment.models import create_new_payment, create_child_payment, CryptoCurrencyPayment
+from cryptocurrency_payment.tasks import CryptoCurrencyPaymentTask
+from cryptocurrency_payment.templatetags.cryptocurrency_payment_tags import payment_qr_url, payment_uri
+
+from merchant_wallet.backends.btc import BitcoinBackend
+
+from tests.test_models import crypto_settings
 
 
 class TestCryptocurrencyView(TestCase):
@@ -54,3 +75,215 @@ class TestCryptocurrencyView(TestCase):
         self.client.force_login(self.user_obj)
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+
+
+class TestCryptocurrencyDetailViewQueries(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user_obj = User.objects.create_user(username="Fake_user")
+        self.payment = create_new_payment("BITCOIN", 10, "USD", user=self.user_obj)
+        create_child_payment(self.payment, 5)
+        self.child_payment = self.payment.child_payment
+        self.client.force_login(self.user_obj)
+
+    def get_detail(self, payment):
+        return self.client.get(reverse("cryptocurrency_payment:crypto_payment_detail", args=(payment.pk,)))
+
+    def test_detail_read_with_one_query(self):
+        for payment in (self.payment, self.child_payment):
+            # session and user of the logged in client, then the payment with its related rows
+            with self.assertNumQueries(3):
+                response = self.get_detail(payment)
+            self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Initial Payment")
+
+    def test_repeat_views_served_from_render_cache(self):
+        response = self.get_detail(self.payment)
+        self.assertTemplateUsed(response, "cryptocurrency_payment/payment_detail.html")
+        with self.assertNumQueries(3):
+            cached_response = self.get_detail(self.payment)
+        self.assertTemplateNotUsed(cached_response, "cryptocurrency_payment/payment_detail.html")
+        self.assertEqual(cached_response.content, response.content)
+
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_PAID
+        self.payment.save()
+        response = self.get_detail(self.payment)
+        self.assertTemplateUsed(response, "cryptocurrency_payment/payment_detail.html")
+        self.assertContains(response, "Paid")
+
+    @override_settings(CRYPTOCURRENCY_PAYMENT_RENDER_CACHE=None)
+    def test_render_cache_can_be_disabled(self):
+        self.get_detail(self.payment)
+        response = self.get_detail(self.payment)
+        self.assertTemplateUsed(response, "cryptocurrency_payment/payment_detail.html")
+
+
+class TestCryptocurrencyStatusView(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user_obj = User.objects.create_user(username="Fake_user")
+        self.payment = create_new_payment("BITCOIN", 10, "USD")
+        self.user_payment = create_new_payment("BITCOIN", 10, "USD", user=self.user_obj)
+        self.url = reverse("cryptocurrency_payment:crypto_payment_status", args=(self.payment.pk,))
+
+    def test_status_read_with_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["status"], CryptoCurrencyPayment.PAYMENT_NEW)
+        self.assertEqual(Decimal(data["crypto_amount"]), self.payment.crypto_amount)
+        self.assertIsNone(data["child_payment_url"])
+        self.assertTrue(response.has_header("ETag"))
+        self.assertTrue(response.has_header("Last-Modified"))
+        self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_unchanged_payment_not_modified(self):
+        response = self.client.get(self.url)
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        not_modified = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_PROCESSING
+        self.payment.save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["status"], CryptoCurrencyPayment.PAYMENT_PROCESSING)
+
+    def test_refreshed_amount_changes_payment_uri_and_qr_url(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data["payment_uri"], payment_uri(self.payment))
+        self.assertEqual(data["qr_url"], payment_qr_url(self.payment))
+
+        self.payment.crypto_amount = Decimal("0.5")
+        self.payment.save()
+        refreshed = self.client.get(self.url).json()
+        self.assertIn("amount=0.5", refreshed["payment_uri"])
+        self.assertEqual(refreshed["qr_url"], payment_qr_url(self.payment))
+        self.assertNotEqual(refreshed["qr_url"], data["qr_url"])
+
+    def test_status_follows_detail_permissions(self):
+        url = reverse("cryptocurrency_payment:crypto_payment_status", args=(self.user_payment.pk,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.user_obj)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_detail_page_polls_status(self):
+        url = reverse("cryptocurrency_payment:crypto_payment_detail", args=(self.payment.pk,))
+        response = self.client.get(url)
+        self.assertContains(response, 'data-status-url="{}"'.format(self.url))
+        self.assertContains(response, "js/cryptocurrency_payment.js")
+
+
+class TestCryptocurrencyNotifyView(TestCase):
+    def setUp(self):
+        self.crypto = "BITCOIN"
+        self.secret = "notify-secret"
+        self.url = reverse("cryptocurrency_payment:crypto_payment_notify", args=(self.crypto.lower(),))
+        self.notify_settings = crypto_settings(self.crypto, NOTIFY_SECRET=self.secret)
+        self.payment = create_new_payment(self.crypto, 10, "USD")
+        self.other_payment = create_new_payment(self.crypto, 10, "USD")
+
+    def notify(self, addresses, secret=None):
+        body = json.dumps({"addresses": addresses}).encode()
+        signature = hmac.new((secret or self.secret).encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(self.url, body, content_type="application/json", HTTP_X_SIGNATURE=signature)
+
+    def test_notify_disabled_without_secret(self):
+        response = self.notify([self.payment.address])
+        self.assertEqual(response.status_code, 404)
+
+    def test_notify_rejects_bad_signature(self):
+        with override_settings(CRYPTOCURRENCY_PAYMENT=self.notify_settings):
+            response = self.notify([self.payment.address], secret="wrong")
+        self.assertEqual(response.status_code, 403)
+
+    def test_notify_rejects_bad_body(self):
+        body = b'{"addresses": "not a list"}'
+        signature = hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        with override_settings(CRYPTOCURRENCY_PAYMENT=self.notify_settings):
+            response = self.client.post(
+                self.url, body, content_type="application/json", HTTP_X_SIGNATURE=signature
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_notified_payment_checked_and_skipped_by_poll(self):
+        with override_settings(CRYPTOCURRENCY_PAYMENT=self.notify_settings), mock.patch(
+            "merchant_wallet.backends.btc.BitcoinBackend.confirm_address_payment",
+            return_value=(BitcoinBackend.NO_HASH_ADDRESS_BALANCE, None),
+        ) as confirm_address_payment:
+            before_notify = timezone.now()
+            response = self.notify([self.payment.address])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {"checked": 1})
+            self.payment.refresh_from_db()
+            self.assertEqual(self.payment.status, CryptoCurrencyPayment.PAYMENT_WAIT)
+            self.assertGreaterEqual(self.payment.next_check_at, before_notify + timedelta(seconds=3600))
+
+            CryptoCurrencyPaymentTask(self.crypto).update_crypto_currency_payment_status()
+            self.assertEqual(
+                [call[1]["address"] for call in confirm_address_payment.call_args_list],
+                [self.payment.address, self.other_payment.address],
+            )
+
+
+class TestCryptocurrencyQRView(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user_obj = User.objects.create_user(username="Fake_user")
+        self.payment = create_new_payment("BITCOIN", 10, "USD", payment_title="Order 1")
+        self.user_payment = create_new_payment("BITCOIN", 10, "USD", user=self.user_obj)
+        self.url = reverse("cryptocurrency_payment:crypto_payment_qr", args=(self.payment.pk,))
+
+    def test_detail_page_links_payment_uri_and_local_qr(self):
+        response = self.client.get(reverse("cryptocurrency_payment:crypto_payment_detail", args=(self.payment.pk,)))
+        uri = payment_uri(self.payment)
+        self.assertTrue(uri.startswith("bitcoin:{}?amount=".format(self.payment.address)))
+        self.assertIn("label=Order%201", uri)
+        self.assertContains(response, 'src="{}?v={}"'.format(self.url, qr.get_qr_digest(uri)))
+        self.assertNotContains(response, "chart.googleapis.com")
+
+    def test_qr_svg_cached_by_digest(self):
+        qr_url = payment_qr_url(self.payment)
+        with mock.patch("cryptocurrency_payment.qr.make_qr_svg", wraps=qr.make_qr_svg) as make_qr_svg:
+            response = self.client.get(qr_url)
+            again = self.client.get(qr_url)
+        self.assertEqual(make_qr_svg.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertTrue(response.content.startswith(b"<svg"))
+        self.assertEqual(again.content, response.content)
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_unversioned_qr_revalidated(self):
+        response = self.client.get(self.url)
+        self.assertIn("no-cache", response["Cache-Control"])
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_qr_url_changes_with_crypto_amount(self):
+        qr_url = payment_qr_url(self.payment)
+        self.payment.status = CryptoCurrencyPayment.PAYMENT_WAIT
+        self.payment.save()
+        self.assertEqual(payment_qr_url(self.payment), qr_url)
+        self.payment.crypto_amount = self.payment.crypto_amount * 2
+        self.payment.save()
+        new_qr_url = payment_qr_url(self.payment)
+        self.assertNotEqual(new_qr_url, qr_url)
+        self.assertNotIn("immutable", self.client.get(qr_url)["Cache-Control"])
+        self.assertIn("immutable", self.client.get(new_qr_url)["Cache-Control"])
+
+    def test_qr_follows_detail_permissions(self):
+        url = reverse("cryptocurrency_payment:crypto_payment_qr", args=(self.user_payment.pk,))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.user_obj)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_external_qr_without_segno(self):
+        with mock.patch("cryptocurrency_payment.qr.segno", None):
+            qr_url = payment_qr_url(self.payment)
+        self.assertTrue(qr_url.startswith("https://chart.googleapis.com/"))
+        self.assertIn(self.payment.address, qr_url)